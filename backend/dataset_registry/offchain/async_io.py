@@ -0,0 +1,175 @@
+"""
+Non-blocking Walrus and enclave I/O for the FastAPI server.
+
+Every call goes through one pooled httpx.AsyncClient, so connections to
+the publisher, aggregator and enclave stay alive between requests.
+Semaphores cap how many Walrus transfers and enclave calls run at once,
+so a burst of large transfers queues up instead of exhausting the pool,
+and cheap endpoints keep answering in the meantime.
+
+Uploads are not here: ingest hashes and uploads in the same threaded
+pipeline (see stages.py), so it uploads with walrus_upload from the
+threadpool, where walrus_upload.upload_slots caps them. ingest_slots
+caps how many requests ingest inline at once, so waiting uploads queue on
+the event loop instead of holding threadpool threads.
+"""
+import asyncio
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from .config import (HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, WALRUS_MAX_TRANSFERS, ENCLAVE_MAX_REQUESTS,
+                     INLINE_INGEST_MAX)
+from .walrus_upload import aggregator_url, guess_download_name
+
+_client: httpx.AsyncClient | None = None
+walrus_slots = asyncio.Semaphore(WALRUS_MAX_TRANSFERS)
+enclave_slots = asyncio.Semaphore(ENCLAVE_MAX_REQUESTS)
+ingest_slots = asyncio.Semaphore(INLINE_INGEST_MAX)
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+            # Blob transfers can take minutes; only connecting should be quick
+            timeout=httpx.Timeout(300, connect=10),
+        )
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def stream_blob(blob_id: str, piece_size: int = 64 * 1024, start: int = 0, length: int | None = None):
+    # Async counterpart of walrus_upload.stream_blob
+    url = f"{aggregator_url}/v1/blobs/{blob_id}"
+    headers = {}
+    if start or length is not None:
+        end = "" if length is None else start + length - 1
+        headers["Range"] = f"bytes={start}-{end}"
+
+    async with walrus_slots:
+        async with get_client().stream("GET", url, headers=headers) as resp:
+            resp.raise_for_status()
+            # An aggregator that ignores Range answers 200 with the whole blob
+            skip = start if resp.status_code != 206 else 0
+            remaining = length
+            async for piece in resp.aiter_bytes(chunk_size=piece_size):
+                if skip:
+                    dropped = min(skip, len(piece))
+                    piece = piece[dropped:]
+                    skip -= dropped
+                if remaining is not None:
+                    piece = piece[:remaining]
+                    remaining -= len(piece)
+                if piece:
+                    yield piece
+                if remaining == 0:
+                    break
+
+
+async def download_dataset_walrus(blob_id: str, range_header: str | None = None, verifier=None):
+    """
+    Stream a blob from the aggregator straight to the client. A Range
+    header is passed through, and the aggregator's status, Content-Range and
+    Content-Length come back unchanged, so clients can fetch slices of a
+    large dataset in parallel.
+    With a verified_stream.StreamVerifier the whole blob is sent (Range is
+    ignored) and each chunk is checked before it leaves; a mismatch aborts
+    the response. The verifier is closed when the body ends.
+    """
+    if verifier is not None:
+        range_header = None
+    url = f"{aggregator_url}/v1/blobs/{blob_id}"
+    # Identity encoding keeps the upstream Content-Length valid for our body
+    headers = {"Accept-Encoding": "identity"}
+    if range_header:
+        headers["Range"] = range_header
+
+    await walrus_slots.acquire()
+    resp = None
+    try:
+        client = get_client()
+        resp = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+        if resp.status_code >= 400:
+            raise HTTPException(status_code=resp.status_code,
+                                detail=f"Aggregator returned {resp.status_code} for blob {blob_id}")
+
+        # The peeked bytes only show the file type if they start the blob
+        pieces = resp.aiter_raw(64 * 1024)
+        first_chunk = await anext(pieces, b"")
+        from_start = resp.status_code != 206 or resp.headers.get("content-range", "").startswith("bytes 0-")
+        mime_type, filename = guess_download_name(blob_id, first_chunk if from_start else b"")
+    except BaseException:
+        if resp is not None:
+            await resp.aclose()
+        walrus_slots.release()
+        if verifier is not None:
+            verifier.close()
+        raise
+
+    async def body():
+        try:
+            if verifier is None:
+                if first_chunk:
+                    yield first_chunk
+                async for piece in pieces:
+                    yield piece
+                return
+
+            out = await asyncio.to_thread(verifier.feed, first_chunk)
+            if out:
+                yield out
+            async for piece in pieces:
+                out = await asyncio.to_thread(verifier.feed, piece)
+                if out:
+                    yield out
+            out = await asyncio.to_thread(verifier.finish)
+            if out:
+                yield out
+        finally:
+            await resp.aclose()
+            walrus_slots.release()
+            if verifier is not None:
+                verifier.close()
+
+    response_headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Accept-Ranges": "bytes",
+    }
+    for name in ("content-length", "content-range", "etag", "last-modified"):
+        if name in resp.headers:
+            response_headers[name] = resp.headers[name]
+
+    return StreamingResponse(body(), status_code=resp.status_code, media_type=mime_type,
+                             headers=response_headers)
+
+
+async def post_enclave(url: str, payload: dict, timeout: float = 30):
+    async with enclave_slots:
+        try:
+            resp = await get_client().post(url, json=payload, timeout=timeout)
+            resp.raise_for_status()
+            return resp.json()
+        except httpx.HTTPError as e:
+            raise Exception(f"Enclave call failed: {str(e)}")
+
+
+async def post_enclave_stream(url: str, body, content_type: str, timeout: float = 60):
+    # post_enclave for a streamed binary body (an async iterable of bytes)
+    async with enclave_slots:
+        try:
+            resp = await get_client().post(url, content=body, headers={"Content-Type": content_type},
+                                           timeout=timeout)
+            resp.raise_for_status()
+            return resp.json()
+        except httpx.HTTPError as e:
+            raise Exception(f"Enclave call failed: {str(e)}")
@@ -0,0 +1,59 @@
+"""
+Leaf-hashing throughput: serial build_merkle path vs. the thread-pool engine.
+
+Run from backend/:
+    python -m dataset_registry.offchain.bench_merkle --size-mb 1024
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from .merkle import CHUNK_SIZE, MerkleBuilder, chunk_file, build_merkle_from_file
+
+
+def serial_root(path, chunk_size):
+    builder = MerkleBuilder()
+    for chunk in chunk_file(path, chunk_size):
+        builder.update(chunk)
+    return builder.finalize()
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, nargs="*",
+                        default=sorted({1, 2, 4, 8, 16, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            tmp.write(block)
+        path = tmp.name
+
+    try:
+        # Warm the page cache so every run measures hashing, not the disk.
+        serial_root(path, args.chunk_size)
+
+        expected, elapsed = timed(serial_root, path, args.chunk_size)
+        print(f"serial      {args.size_mb / elapsed:9.1f} MB/s")
+
+        for workers in args.workers:
+            (root, _), elapsed = timed(build_merkle_from_file, path, args.chunk_size, workers)
+            if root != expected:
+                raise SystemExit(f"root mismatch with {workers} workers")
+            print(f"workers={workers:<4}{args.size_mb / elapsed:9.1f} MB/s")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Bounded on-disk read-through cache for Walrus blobs, keyed by blob_id.
+
+Only blobs whose Merkle root is registered in the blob index are cached.
+A blob is checked chunk by chunk against its stored tree as it is fetched
+(verified_stream.StreamVerifier) and admitted only if it reproduces the
+root, so everything served from the cache is verified content.
+Concurrent misses for the same blob share one fetch, and once the byte
+budget is exceeded the least recently used blobs are evicted.
+
+A miss does not hold the client back until the fetch is done: verified
+bytes are sent as soon as they reach the cache file. A Range request on a
+miss is answered straight from the aggregator while the fetch fills the
+cache in the background, so parallel slice downloads still work on cold
+blobs. Blobs whose stored tree shows they are larger than the whole
+budget are never fetched into the cache, and are remembered as such.
+
+The cache is driven from the server's event loop; hashing and file I/O
+run in worker threads.
+"""
+import asyncio
+import os
+import uuid
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from . import async_io
+from .blob_index import blob_index
+from .config import BLOB_CACHE_DIR, BLOB_CACHE_MAX_BYTES
+from .merkle_store import store as merkle_store
+from .verified_stream import StreamVerifier, IntegrityError
+from .walrus_upload import guess_download_name
+
+PIECE_SIZE = 1024 * 1024
+
+
+class Fill:
+    """
+    A blob being fetched into the cache. Readers follow its temp file as
+    verified bytes are appended to it.
+    """
+
+    def __init__(self, tmp_path: str):
+        self.tmp_path = tmp_path
+        self.written = 0
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def _wake(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def advance(self, n: int):
+        self.written += n
+        self._wake()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    async def follow(self, f):
+        # The blob's bytes read from `f` (the temp file) as they are written;
+        # raises if the fetch fails
+        with f:
+            sent = 0
+            while True:
+                changed = self.changed
+                if sent < self.written:
+                    piece = await asyncio.to_thread(f.read, min(PIECE_SIZE, self.written - sent))
+                    sent += len(piece)
+                    yield piece
+                elif self.error is not None:
+                    raise self.error
+                elif self.done:
+                    return
+                else:
+                    await changed.wait()
+
+
+class BlobCache:
+    def __init__(self, directory: str = BLOB_CACHE_DIR, max_bytes: int = BLOB_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # blob_id -> size, least recently used first
+        self.size = 0
+        self.inflight = {}
+        self.uncacheable = set()  # blobs larger than the whole budget
+        self.hits = self.misses = self.fills = self.evictions = self.verify_failures = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        # Rebuild the LRU order from access times; drop interrupted fills
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            files.append((st.st_atime, name, st.st_size))
+        for _, blob_id, size in sorted(files):
+            self.entries[blob_id] = size
+            self.size += size
+        if files:
+            print(f"[blob_cache] Loaded {len(files)} blobs ({self.size} bytes)")
+
+    def path(self, blob_id: str) -> str:
+        return os.path.join(self.directory, blob_id)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "fills": self.fills,
+            "evictions": self.evictions,
+            "verify_failures": self.verify_failures,
+            "entries": len(self.entries),
+            "uncacheable": len(self.uncacheable),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _open_entry(self, blob_id: str):
+        if blob_id not in self.entries:
+            return None
+        self.entries.move_to_end(blob_id)
+        # An open handle keeps the data readable even if the entry is evicted
+        return open(self.path(blob_id), "rb")
+
+    async def response(self, blob_id: str, range_header: str | None = None):
+        """
+        Response serving a blob through the cache, or None when the caller
+        should stream it from the aggregator: the blob cannot be cached (no
+        registered root or stored tree, or larger than the whole budget),
+        or it is a Range request on a blob that is not cached yet (its
+        fetch is started in the background).
+        """
+        if os.sep in blob_id or blob_id.startswith(".") or blob_id in self.uncacheable:
+            return None
+
+        f = self._open_entry(blob_id)
+        if f is not None:
+            self.hits += 1
+            return file_response(f, blob_id, range_header)
+
+        fill = self.inflight.get(blob_id)
+        if fill is None:
+            root_hex = blob_index.root_for_blob(blob_id)
+            tree = merkle_store.open(root_hex) if root_hex else None
+            if tree is None:
+                return None
+            with tree:
+                # Exact for content-defined trees, within a chunk for fixed-size ones
+                size_bound = tree.chunk_offset(tree.leaf_count)
+            if size_bound > self.max_bytes:
+                print(f"[blob_cache] {blob_id} exceeds the cache budget, not caching")
+                self.uncacheable.add(blob_id)
+                return None
+            fill = self._start_fill(blob_id, root_hex)
+        self.misses += 1
+
+        if range_header:
+            return None
+        return await fill_response(fill, blob_id)
+
+    def _start_fill(self, blob_id: str, root_hex: str) -> Fill:
+        tmp_path = f"{self.path(blob_id)}.{uuid.uuid4().hex}.tmp"
+        f = open(tmp_path, "wb")
+        fill = Fill(tmp_path)
+        self.inflight[blob_id] = fill
+        # Not tied to any one client: it runs to the end even if they all leave
+        task = asyncio.ensure_future(self._fill(blob_id, root_hex, fill, f))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return fill
+
+    async def _fill(self, blob_id: str, root_hex: str, fill: Fill, f):
+        size = 0
+        try:
+            with merkle_store.open(root_hex) as tree, f:
+                verifier = StreamVerifier(tree.root, tree)
+
+                def write_verified(piece):
+                    data = verifier.feed(piece) if piece is not None else verifier.finish()
+                    f.write(data)
+                    f.flush()
+                    return len(data)
+
+                try:
+                    async for piece in async_io.stream_blob(blob_id, piece_size=PIECE_SIZE):
+                        fill.advance(await asyncio.to_thread(write_verified, piece))
+                    fill.advance(await asyncio.to_thread(write_verified, None))
+                except IntegrityError as e:
+                    self.verify_failures += 1
+                    raise IntegrityError(f"Blob {blob_id}: {e}")
+            size = fill.written
+
+            # Readers keep their handles on the temp file across the rename
+            self._make_room(size)
+            os.replace(fill.tmp_path, self.path(blob_id))
+            self.entries[blob_id] = size
+            self.size += size
+            self.fills += 1
+            fill.finish()
+            print(f"[blob_cache] Cached {blob_id} ({size} bytes)")
+        except BaseException as e:
+            print(f"[blob_cache] Fetching {blob_id} failed: {e}")
+            fill.finish(e)
+            raise
+        finally:
+            self.inflight.pop(blob_id, None)
+            if os.path.exists(fill.tmp_path):
+                os.remove(fill.tmp_path)
+
+    def _make_room(self, size: int):
+        while self.entries and self.size + size > self.max_bytes:
+            evicted, evicted_size = self.entries.popitem(last=False)
+            os.remove(self.path(evicted))
+            self.size -= evicted_size
+            self.evictions += 1
+            print(f"[blob_cache] Evicted {evicted}")
+
+
+def parse_range(range_header: str | None, size: int):
+    """
+    (start, end) inclusive for a single "bytes=" range, or None to send the
+    whole file. Multi-range requests are answered with the whole file.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    first, _, last = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def file_response(f, blob_id: str, range_header: str | None = None):
+    """
+    StreamingResponse for an open cached blob, honouring a Range header the
+    same way the aggregator does. Takes ownership of `f`.
+    """
+    size = os.fstat(f.fileno()).st_size
+    mime_type, filename = guess_download_name(blob_id, f.read(2048))
+    try:
+        byte_range = parse_range(range_header, size)
+    except HTTPException:
+        f.close()
+        raise
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Accept-Ranges": "bytes",
+    }
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    async def body():
+        try:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                piece = await asyncio.to_thread(f.read, min(PIECE_SIZE, remaining))
+                if not piece:
+                    break
+                remaining -= len(piece)
+                yield piece
+        finally:
+            f.close()
+
+    return StreamingResponse(body(), status_code=status, media_type=mime_type, headers=headers)
+
+
+async def fill_response(fill: Fill, blob_id: str):
+    """
+    StreamingResponse following a fill from its start, sent as the bytes
+    are verified. A failed fetch aborts the response.
+    """
+    pieces = fill.follow(open(fill.tmp_path, "rb"))
+    try:
+        first_chunk = await anext(pieces, b"")
+    except BaseException:
+        await pieces.aclose()
+        raise
+    mime_type, filename = guess_download_name(blob_id, first_chunk)
+
+    async def body():
+        try:
+            if first_chunk:
+                yield first_chunk
+            async for piece in pieces:
+                yield piece
+        finally:
+            await pieces.aclose()
+
+    return StreamingResponse(body(), media_type=mime_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Accept-Ranges": "bytes",
+    })
+
+
+blob_cache = BlobCache()
@@ -0,0 +1,106 @@
+"""
+Content-addressed index of datasets already stored on Walrus.
+
+Maps a dataset's Merkle root to the blob_info returned by the upload that
+stored it, so identical content is never uploaded twice. The index is
+bounded: once it holds max_entries roots the least recently used one is
+dropped.
+
+Walrus only stores a blob until the end epoch of its storage. Every upload
+reports the epoch it was registered in, so the index keeps the latest
+epoch it has seen and treats entries whose storage.end_epoch is not after
+it as expired: get() drops them and returns None. Callers still confirm a
+hit with the aggregator (see run_pipeline.stored_blob), since the index
+only learns the current epoch when something is uploaded.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .config import BLOB_INDEX_FILE, BLOB_INDEX_MAX_ENTRIES
+
+
+class BlobIndex:
+    def __init__(self, path: str = BLOB_INDEX_FILE, max_entries: int = BLOB_INDEX_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.roots = {}  # blob_id -> merkle_root, for checking downloads
+        self.epoch = 0  # latest Walrus epoch seen in an upload
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.entries = OrderedDict(json.load(f))
+            self.roots = {info.get("blob_id"): root for root, info in self.entries.items()}
+            self.epoch = max((seen_epoch(info) for info in self.entries.values()), default=0)
+            print(f"[blob_index] Loaded {len(self.entries)} entries")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[blob_index] Error loading index: {e}")
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, merkle_root: str):
+        with self.lock:
+            blob_info = self.entries.get(merkle_root)
+            if blob_info is None:
+                return None
+            if end_epoch(blob_info) and end_epoch(blob_info) <= self.epoch:
+                print(f"[blob_index] {merkle_root} expired at epoch {end_epoch(blob_info)} (now {self.epoch})")
+                self._remove(merkle_root)
+                self.save()
+                return None
+            self.entries.move_to_end(merkle_root)
+            return blob_info
+
+    def put(self, merkle_root: str, blob_info: dict):
+        with self.lock:
+            self.entries[merkle_root] = blob_info
+            self.entries.move_to_end(merkle_root)
+            self.roots[blob_info.get("blob_id")] = merkle_root
+            self.epoch = max(self.epoch, seen_epoch(blob_info))
+            while len(self.entries) > self.max_entries:
+                evicted = next(iter(self.entries))
+                self._remove(evicted)
+                print(f"[blob_index] Evicted {evicted}")
+            self.save()
+
+    def drop(self, merkle_root: str):
+        # Forget a root whose blob Walrus no longer stores
+        with self.lock:
+            if merkle_root in self.entries:
+                self._remove(merkle_root)
+                self.save()
+
+    def _remove(self, merkle_root: str):
+        blob_id = self.entries.pop(merkle_root).get("blob_id")
+        if self.roots.get(blob_id) == merkle_root:
+            del self.roots[blob_id]
+
+    def root_for_blob(self, blob_id: str):
+        # Merkle root registered for a stored blob, if the index knows it
+        with self.lock:
+            return self.roots.get(blob_id)
+
+
+def end_epoch(blob_info: dict) -> int:
+    # First epoch in which the blob is no longer stored (0 if unknown)
+    return (blob_info.get("storage") or {}).get("end_epoch") or 0
+
+
+def seen_epoch(blob_info: dict) -> int:
+    # The epoch an upload happened in; already-certified answers carry none
+    storage = blob_info.get("storage") or {}
+    return max(blob_info.get("registered_epoch") or 0, storage.get("start_epoch") or 0)
+
+
+blob_index = BlobIndex()
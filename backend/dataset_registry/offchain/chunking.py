@@ -0,0 +1,191 @@
+"""
+Chunk sources for Merkle leaves.
+
+FixedChunker cuts every chunk_size bytes (the original behaviour).
+FastCDC cuts where a rolling gear hash of the content hits a mask, so an
+insertion only changes the chunks around it and every later leaf keeps
+its hash.
+
+Both are described by (kind, chunk_size, min_size, max_size), which is
+stored with the Merkle tree so anyone can re-chunk the data the same way.
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .merkle import CHUNK_SIZE, chunk_stream
+
+FIXED = 0
+FASTCDC = 1
+
+
+class FixedChunker:
+    kind = FIXED
+    variable = False
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.min_size = self.max_size = chunk_size
+
+    def chunks(self, stream):
+        return chunk_stream(stream, self.chunk_size)
+
+    def spec(self):
+        return {"chunker": "fixed", "chunk_size": self.chunk_size}
+
+
+def _gear_table():
+    # Fixed, reproducible pseudo-random table; changing it changes every root.
+    words = [hashlib.sha256(b"chaintrain-gear-%d" % i).digest()[:4] for i in range(256)]
+    return np.frombuffer(b"".join(words), dtype="<u4").astype(np.uint32)
+
+
+def _top_bits_mask(bits: int):
+    return np.uint32(((1 << bits) - 1) << (32 - bits))
+
+
+class FastCDC:
+    """
+    FastCDC-style content-defined chunker with normalized chunking: a
+    stricter mask before avg_size and a looser one after it keep chunk
+    sizes close to the average.
+
+    The 32-bit gear hash h = (h << 1) + GEAR[byte] only depends on the
+    last 32 bytes, so it is computed for a whole slice at once with numpy
+    by doubling the window five times (1, 2, 4, 8, 16 -> 32 bytes) rather
+    than looping per byte. Slices are sized to stay in cache and are hashed
+    on a thread pool (numpy releases the GIL); only the positions where a
+    mask hits are visited in Python.
+    """
+
+    kind = FASTCDC
+    variable = True
+    GEAR = _gear_table()
+    WINDOW = 32
+    SLICE = 256 * 1024
+
+    def __init__(self, min_size: int = CHUNK_SIZE // 4, avg_size: int = CHUNK_SIZE,
+                 max_size: int = CHUNK_SIZE * 4, block_size: int = 16 * 1024 * 1024,
+                 workers: int | None = None):
+        if not self.WINDOW <= min_size <= avg_size <= max_size:
+            raise ValueError(f"FastCDC needs {self.WINDOW} <= min_size <= avg_size <= max_size")
+        self.min_size = min_size
+        self.chunk_size = avg_size
+        self.max_size = max_size
+        self.block_size = max(block_size, 2 * max_size)
+        self.workers = workers or os.cpu_count()
+
+        bits = max(avg_size.bit_length() - 1, 3)
+        self.mask_s = _top_bits_mask(min(bits + 2, 32))
+        self.mask_l = _top_bits_mask(bits - 2)
+
+    def spec(self):
+        return {"chunker": "fastcdc", "min_size": self.min_size,
+                "avg_size": self.chunk_size, "max_size": self.max_size}
+
+    def _slice_hits(self, data, start: int, end: int):
+        # Gear hashes for positions [start, end), with WINDOW - 1 bytes of
+        # lookback so the result does not depend on where the slice begins.
+        lookback = min(start, self.WINDOW - 1)
+        h = np.take(self.GEAR, np.frombuffer(data, dtype=np.uint8, count=end - start + lookback,
+                                             offset=start - lookback))
+        tmp = np.empty_like(h)
+        n = len(h)
+        for step in (1, 2, 4, 8, 16):
+            if step >= n:
+                break
+            np.left_shift(h[:n - step], step, out=tmp[:n - step])
+            h[step:] += tmp[:n - step]
+        h = h[lookback:]
+
+        # mask_s covers mask_l's bits, so its hits are a subset
+        hits_l = np.flatnonzero((h & self.mask_l) == 0)
+        hits_s = hits_l[(h[hits_l] & self.mask_s) == 0]
+        return hits_s + (start + 1), hits_l + (start + 1)
+
+    def candidate_ends(self, data, start: int = 0):
+        """
+        Chunk ends (position after a mask hit) for the strict and the loose
+        mask across `data` from `start` on. A hit depends only on the WINDOW
+        bytes before it, so ends found earlier stay valid when data is appended.
+        """
+        slices = [(s, min(s + self.SLICE, len(data))) for s in range(start, len(data), self.SLICE)]
+        if len(slices) > 1 and self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(lambda r: self._slice_hits(data, *r), slices))
+        else:
+            results = [self._slice_hits(data, *r) for r in slices]
+        if not results:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        return (np.concatenate([r[0] for r in results]),
+                np.concatenate([r[1] for r in results]))
+
+    def cut_points(self, data, eof: bool, ends=None):
+        """
+        Chunk end offsets in `data`. Without `eof`, stops at the first chunk
+        whose end could still depend on bytes not read yet. `ends` is the
+        result of candidate_ends(data) if the caller already has it.
+        """
+        n = len(data)
+        ends_s, ends_l = ends if ends is not None else self.candidate_ends(data)
+
+        cuts = []
+        start = 0
+        while start < n:
+            if not eof and n - start < self.max_size:
+                break
+            if n - start <= self.min_size:
+                cuts.append(n)
+                break
+
+            normal = min(start + self.chunk_size, n)
+            limit = min(start + self.max_size, n)
+            k = np.searchsorted(ends_s, start + self.min_size, side="right")
+            if k < len(ends_s) and ends_s[k] <= normal:
+                end = int(ends_s[k])
+            else:
+                k = np.searchsorted(ends_l, normal, side="right")
+                end = int(ends_l[k]) if k < len(ends_l) and ends_l[k] <= limit else limit
+            cuts.append(end)
+            start = end
+        return cuts
+
+    def chunks(self, stream):
+        # Reads are collected as pieces and joined once per block, and the
+        # candidate ends of the tail carried into the next block are kept,
+        # so each byte is copied and scanned once however short the reads.
+        buf = b""
+        ends_s = ends_l = np.empty(0, dtype=np.int64)
+        eof = False
+        while not eof or buf:
+            pieces, size = [buf], len(buf)
+            while not eof and size < self.block_size:
+                more = stream.read(self.block_size - size)
+                if more:
+                    pieces.append(more)
+                    size += len(more)
+                else:
+                    eof = True
+
+            scanned = len(buf)
+            buf = b"".join(pieces)
+            new_s, new_l = self.candidate_ends(buf, scanned)
+            ends_s = np.concatenate([ends_s, new_s])
+            ends_l = np.concatenate([ends_l, new_l])
+
+            start = 0
+            for end in self.cut_points(buf, eof, (ends_s, ends_l)):
+                yield buf[start:end]
+                start = end
+            buf = buf[start:]
+            ends_s = ends_s[ends_s > start] - start
+            ends_l = ends_l[ends_l > start] - start
+
+
+def chunker_for(kind: int, chunk_size: int, min_size: int = 0, max_size: int = 0):
+    if kind == FASTCDC:
+        return FastCDC(min_size, chunk_size, max_size)
+    return FixedChunker(chunk_size)
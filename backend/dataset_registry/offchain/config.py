@@ -3,3 +3,65 @@ NETWORK = "testnet"
 
 WALRUS_ENDPOINT = "https://walrus.xyz/api"
 NAUTILUS_ENDPOINT = "https://nautilus.ai/api"
+
+MERKLE_STORE_DIR = "./merkle_store"
+BLOB_INDEX_FILE = "./blob_index.json"
+BLOB_INDEX_MAX_ENTRIES = 10000
+MANIFEST_DIR = "./manifests"
+
+# Largest chunk size /api/proofs will rebuild a blob's tree with
+PROOF_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Pooled async HTTP client used by the server for Walrus and the enclave
+HTTP_MAX_CONNECTIONS = 64
+HTTP_MAX_KEEPALIVE = 32
+WALRUS_MAX_TRANSFERS = 16
+ENCLAVE_MAX_REQUESTS = 8
+
+# Blocking uploads to the publisher (ingest, multipart parts) run on threads:
+# how many may be in flight, their (connect, read) timeouts in seconds, and
+# how many /upload-dataset requests may ingest at once on the shared
+# threadpool (the rest wait on the event loop, not on a thread)
+WALRUS_MAX_UPLOADS = 8
+WALRUS_UPLOAD_TIMEOUT = (10, 300)
+INLINE_INGEST_MAX = 8
+
+# On-disk read-through cache for blobs served by /download-dataset
+BLOB_CACHE_DIR = "./blob_cache"
+BLOB_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+# SHA-256 of datasets by (path, inode, size, mtime_ns); set the file to None
+# to keep the cache in memory only
+DATASET_HASH_CACHE_FILE = "./dataset_hash_cache.json"
+DATASET_HASH_CACHE_MAX_ENTRIES = 4096
+
+# Training history and lineage graph (SQLite)
+HISTORY_DB = "./training_history.db"
+
+# Background ingest/train jobs
+JOBS_DB = "./jobs.db"
+JOB_SPOOL_DIR = "./job_spool"
+JOB_WORKERS = 4
+JOB_QUEUE_MAX = 1000
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Batched dataset registration on Sui: calls per transaction, pure-argument
+# bytes per transaction (Sui caps a transaction at 128 KiB), gas and how long
+# a partial batch waits before it is sent
+SUI_BATCH_MAX_CALLS = 200
+SUI_BATCH_MAX_BYTES = 96 * 1024
+SUI_BATCH_FLUSH_SECONDS = 2.0
+SUI_GAS_PER_REGISTRATION = 20000000
+SUI_MAX_GAS_BUDGET = 50000000000
+
+# Chunks buffered between ingest stages (read, Merkle hashing, upload)
+PIPELINE_QUEUE_DEPTH = 8
+
+# Measurement (PCRs) of the registered enclave image. Training results are
+# memoized per dataset and enclave; POST /api/enclave/register replaces
+# this and drops the memoized results.
+ENCLAVE_MEASUREMENT = ""
+
+# /api/verify/batch: items per request, datasets hashed at once
+VERIFY_BATCH_MAX_ITEMS = 10000
+VERIFY_BATCH_HASH_WORKERS = 4
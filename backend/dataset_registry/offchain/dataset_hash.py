@@ -0,0 +1,130 @@
+"""
+Streaming SHA-256 of dataset files with a stat-keyed cache.
+
+Files are hashed in fixed-size reads, so memory use does not depend on the
+dataset size. Digests are cached under (path, inode, size, mtime_ns): a
+file rewritten in place gets a new key and is hashed again, and the cache
+is bounded, dropping the least recently used entry when full. With a
+backing file the cache survives restarts, so unchanged datasets are not
+rehashed.
+
+hash_stream covers data that is not a file yet (an upload): one pass
+gives the SHA-256 and the Merkle leaves, optionally copying the data to
+disk on the way.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .config import DATASET_HASH_CACHE_FILE, DATASET_HASH_CACHE_MAX_ENTRIES
+from .merkle import CHUNK_SIZE, MerkleBuilder, chunk_stream, hash as hash_chunk
+
+READ_SIZE = 1024 * 1024
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    buf = bytearray(READ_SIZE)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def sha256_stream(stream) -> str:
+    # SHA-256 of the rest of `stream`
+    digest = hashlib.sha256()
+    for chunk in chunk_stream(stream, READ_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_stream(stream, out=None, chunk_size: int = CHUNK_SIZE):
+    """
+    Read `stream` once in chunk_size chunks, writing them to `out` if
+    given. Returns (sha256 hex, merkle) where merkle is (root, leaves), or
+    None for empty input.
+    """
+    digest = hashlib.sha256()
+    builder = MerkleBuilder()
+    leaves = []
+    for chunk in chunk_stream(stream, chunk_size):
+        digest.update(chunk)
+        leaf = hash_chunk(chunk)
+        builder.update_leaf(leaf)
+        leaves.append(leaf)
+        if out is not None:
+            out.write(chunk)
+    merkle = (builder.finalize(), leaves) if leaves else None
+    return digest.hexdigest(), merkle
+
+
+class DatasetHashCache:
+    def __init__(self, path: str | None = DATASET_HASH_CACHE_FILE,
+                 max_entries: int = DATASET_HASH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as f:
+                self.entries = OrderedDict(json.load(f))
+            print(f"[dataset_hash] Loaded {len(self.entries)} cached hashes")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[dataset_hash] Error loading cache: {e}")
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def key(path: str) -> str:
+        # Raises FileNotFoundError for missing files
+        st = os.stat(path)
+        return f"{os.path.realpath(path)}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+    def get(self, key: str):
+        with self.lock:
+            digest = self.entries.get(key)
+            if digest is not None:
+                self.entries.move_to_end(key)
+            return digest
+
+    def put(self, key: str, digest: str):
+        with self.lock:
+            self.entries[key] = digest
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.save()
+
+    def remember(self, path: str, digest: str):
+        # Record a digest computed elsewhere (e.g. while saving an upload)
+        self.put(self.key(path), digest)
+
+    def compute(self, path: str) -> str:
+        key = self.key(path)
+        digest = self.get(key)
+        if digest is None:
+            digest = sha256_file(path)
+            # Only cache if the file did not change while it was read
+            if self.key(path) == key:
+                self.put(key, digest)
+        return digest
+
+
+dataset_hashes = DatasetHashCache()
@@ -0,0 +1,139 @@
+"""
+Memoized enclave training results.
+
+A signed training result depends only on the dataset and on the enclave
+that produced it, so results are remembered per (dataset_hash,
+enclave_key), where enclave_key hashes the enclave URL and the measurement
+(PCRs) it was registered with. A repeat of a training request returns
+the stored record from the training history instead of calling the
+enclave again, and identical requests that arrive together share one
+enclave call.
+
+The measurement comes from ENCLAVE_MEASUREMENT until an enclave is
+registered through register(); registering a new enclave drops every
+remembered result, since results signed by the old enclave no longer
+verify against the registered one. Results are kept in the
+enclave_results table next to the training history they point into.
+"""
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+
+from .config import HISTORY_DB, ENCLAVE_MEASUREMENT
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS enclave_results (
+    dataset_hash TEXT NOT NULL,
+    enclave_key  TEXT NOT NULL,
+    request_hash TEXT NOT NULL,
+    created_at   INTEGER NOT NULL,
+    PRIMARY KEY (dataset_hash, enclave_key)
+);
+CREATE TABLE IF NOT EXISTS enclave_registrations (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    enclave_url   TEXT NOT NULL,
+    measurement   TEXT NOT NULL,
+    registered_at INTEGER NOT NULL
+);
+"""
+
+
+def enclave_key(enclave_url: str, measurement: str) -> str:
+    return hashlib.sha256(f"{enclave_url}\n{measurement}".encode()).hexdigest()
+
+
+class EnclaveResultCache:
+    def __init__(self, history, enclave_url: str, path: str = HISTORY_DB,
+                 measurement: str = ENCLAVE_MEASUREMENT):
+        self.history = history
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        # The latest registration of this enclave wins over the configured measurement
+        row = self.db.execute("SELECT measurement, registered_at FROM enclave_registrations WHERE enclave_url = ?"
+                              " ORDER BY id DESC LIMIT 1", (enclave_url,)).fetchone()
+        self.enclave_url = enclave_url
+        self.measurement, self.registered_at = row if row else (measurement, None)
+        self.key = enclave_key(enclave_url, self.measurement)
+        self.inflight = {}
+        self.hits = self.misses = self.shared = 0
+
+    def get(self, dataset_hash: str):
+        """
+        Stored training record for this dataset under the current enclave,
+        or None.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT request_hash FROM enclave_results WHERE dataset_hash = ? AND enclave_key = ?",
+                                  (dataset_hash, self.key)).fetchone()
+        return self.history.get(row[0]) if row else None
+
+    def put(self, dataset_hash: str, request_hash: str, key: str):
+        with self.lock:
+            # A result from an enclave that has since been replaced is not kept
+            if key != self.key:
+                return
+            self.db.execute("INSERT OR REPLACE INTO enclave_results (dataset_hash, enclave_key, request_hash, created_at)"
+                            " VALUES (?, ?, ?, ?)", (dataset_hash, key, request_hash, int(time.time() * 1000)))
+
+    async def get_or_train(self, dataset_hash: str, train):
+        """
+        (record, cached): the remembered record for this dataset, or the
+        record returned by `await train()`, which must store it in the
+        training history. Concurrent calls for the same dataset share one
+        train().
+        """
+        record = await asyncio.to_thread(self.get, dataset_hash)
+        if record is not None:
+            self.hits += 1
+            return record, True
+
+        flight_key = (dataset_hash, self.key)
+        flight = self.inflight.get(flight_key)
+        if flight is not None:
+            self.shared += 1
+            # Shielded so one client disconnecting does not cancel the shared call
+            return await asyncio.shield(flight), True
+
+        self.misses += 1
+        flight = asyncio.ensure_future(self._train(dataset_hash, train, self.key))
+        self.inflight[flight_key] = flight
+        flight.add_done_callback(lambda _: self.inflight.pop(flight_key, None))
+        return await asyncio.shield(flight), False
+
+    async def _train(self, dataset_hash: str, train, key: str):
+        record = await train()
+        await asyncio.to_thread(self.put, dataset_hash, record["request_hash"], key)
+        return record
+
+    def register(self, measurement: str) -> int:
+        """
+        Record a newly registered enclave and forget every result signed
+        by earlier ones. Returns how many results were dropped.
+        """
+        now = int(time.time() * 1000)
+        with self.lock:
+            self.db.execute("INSERT INTO enclave_registrations (enclave_url, measurement, registered_at)"
+                            " VALUES (?, ?, ?)", (self.enclave_url, measurement, now))
+            dropped = self.db.execute("DELETE FROM enclave_results").rowcount
+            self.measurement, self.registered_at = measurement, now
+            self.key = enclave_key(self.enclave_url, measurement)
+        print(f"[enclave_results] Enclave registered ({measurement[:16]}...), dropped {dropped} cached results")
+        return dropped
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM enclave_results WHERE enclave_key = ?",
+                                      (self.key,)).fetchone()[0]
+        return {
+            "enclave_url": self.enclave_url,
+            "measurement": self.measurement,
+            "registered_at": self.registered_at,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+        }
@@ -0,0 +1,45 @@
+"""
+Binary framing for streaming a dataset to the enclave's /process_data.
+
+    header:  b"NDS1" | Merkle root (32 bytes) | chunk size (u32)
+    frame:   chunk length (u32) | SHA-256 of the chunk (32 bytes) | chunk
+    end:     a frame of length 0 with an all-zero hash
+
+Integers are big-endian. Chunks are the dataset's Merkle leaves, so the
+enclave checks each chunk against its hash as it arrives and rebuilds the
+root at the end, holding at most one chunk at a time. The body is sent
+with Content-Type CONTENT_TYPE; JSON bodies still get the old handling.
+"""
+import asyncio
+import struct
+
+from .merkle import CHUNK_SIZE, MerkleBuilder, hash_file_leaves
+
+CONTENT_TYPE = "application/x-nautilus-dataset"
+MAGIC = b"NDS1"
+HEADER = struct.Struct(">4s32sI")
+FRAME = struct.Struct(">I32s")
+
+
+def dataset_leaves(path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    (root, leaves) of a dataset file. The leaves are 32 bytes per chunk,
+    so they are cheap to keep for the frames.
+    """
+    builder = MerkleBuilder()
+    leaves = []
+    for leaf in hash_file_leaves(path, chunk_size):
+        builder.update_leaf(leaf)
+        leaves.append(leaf)
+    return builder.finalize(), leaves
+
+
+async def frames(path: str, root: bytes, leaves, chunk_size: int = CHUNK_SIZE):
+    # Async body for httpx: reads one chunk at a time off the event loop
+    yield HEADER.pack(MAGIC, root, chunk_size)
+    with open(path, "rb") as f:
+        for leaf in leaves:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            yield FRAME.pack(len(chunk), leaf)
+            yield chunk
+    yield FRAME.pack(0, bytes(32))
@@ -0,0 +1,163 @@
+"""
+Durable training-history store on SQLite.
+
+Each training record is one row, so adding a record is a single indexed
+insert rather than a rewrite of the whole history, and WAL journaling
+keeps the file consistent if the server dies mid-write. request_hash is
+the primary key. Records are indexed by (timestamp,
+request_hash), alone and after dataset_hash or dataset_source, so a page
+of history is read straight off an index with a keyset cursor whatever
+the filters. Opening the store reads no records; the number of records
+is counted once there and then kept in memory, so health checks never
+scan the table.
+
+A training_history.json from before the store existed is imported once
+and renamed to *.migrated.
+"""
+import base64
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS training_history (
+    request_hash   TEXT PRIMARY KEY,
+    dataset_hash   TEXT,
+    dataset_source TEXT,
+    timestamp      INTEGER NOT NULL,
+    record         TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS training_history_time ON training_history (timestamp, request_hash);
+CREATE INDEX IF NOT EXISTS training_history_dataset_time
+    ON training_history (dataset_hash, timestamp, request_hash);
+CREATE INDEX IF NOT EXISTS training_history_source_time
+    ON training_history (dataset_source, timestamp, request_hash);
+"""
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(timestamp: int, request_hash: str) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp}:{request_hash}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    # Raises ValueError for anything encode_cursor did not produce
+    try:
+        timestamp, _, request_hash = base64.urlsafe_b64decode(cursor.encode()).decode().partition(":")
+        return int(timestamp), request_hash
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def record_timestamp(record: dict) -> int:
+    # Milliseconds since the epoch, from the enclave or the ISO fallback
+    if record.get("timestamp"):
+        return int(record["timestamp"])
+    return int(datetime.fromisoformat(record["timestamp_iso"]).timestamp() * 1000)
+
+
+class TrainingHistory:
+    def __init__(self, path: str, legacy_json: str | None = None):
+        self.path = path
+        self.lock = threading.Lock()
+        # Used from the event loop and the threadpool, always under self.lock
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(SCHEMA)
+        self.count = self.db.execute("SELECT COUNT(*) FROM training_history").fetchone()[0]
+        if legacy_json and os.path.exists(legacy_json):
+            self.import_json(legacy_json)
+
+    def import_json(self, legacy_json: str):
+        try:
+            with open(legacy_json) as f:
+                records = json.load(f)
+            with self.lock:
+                with self.db:
+                    self.db.execute("BEGIN")
+                    added = sum(self._insert(record) for record in records.values())
+                self.count += added
+            os.replace(legacy_json, f"{legacy_json}.migrated")
+            print(f"[history] Imported {len(records)} training records from {legacy_json}")
+        except Exception as e:
+            print(f"[history] Error importing {legacy_json}: {e}")
+
+    def _insert(self, record: dict) -> int:
+        # Returns 1 for a new request_hash, 0 when an existing record was replaced
+        values = (record.get("dataset_hash"), record.get("dataset_source"),
+                  record_timestamp(record), json.dumps(record), record["request_hash"])
+        cur = self.db.execute(
+            "INSERT OR IGNORE INTO training_history"
+            " (dataset_hash, dataset_source, timestamp, record, request_hash) VALUES (?, ?, ?, ?, ?)",
+            values,
+        )
+        if cur.rowcount == 1:
+            return 1
+        self.db.execute(
+            "UPDATE training_history SET dataset_hash = ?, dataset_source = ?, timestamp = ?, record = ?"
+            " WHERE request_hash = ?",
+            values,
+        )
+        return 0
+
+    def put(self, record: dict):
+        with self.lock:
+            self.count += self._insert(record)
+
+    def get(self, request_hash: str):
+        with self.lock:
+            row = self.db.execute("SELECT record FROM training_history WHERE request_hash = ?",
+                                  (request_hash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, request_hash: str) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM training_history WHERE request_hash = ?",
+                                   (request_hash,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        # Kept up to date by put(); no query, so it is safe on the event loop
+        return self.count
+
+    def page(self, limit: int = 50, cursor: str | None = None, dataset_hash: str | None = None,
+             dataset_source: str | None = None, since: int | None = None, until: int | None = None):
+        """
+        Up to `limit` records, newest first, and the cursor for the next
+        page (None on the last page). since/until bound the timestamp in
+        milliseconds, inclusive.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        where, params = [], []
+        if dataset_hash is not None:
+            where.append("dataset_hash = ?")
+            params.append(dataset_hash)
+        if dataset_source is not None:
+            where.append("dataset_source = ?")
+            params.append(dataset_source)
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("timestamp <= ?")
+            params.append(until)
+        if cursor:
+            where.append("(timestamp, request_hash) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        sql = "SELECT timestamp, request_hash, record FROM training_history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp DESC, request_hash DESC LIMIT ?"
+        with self.lock:
+            rows = self.db.execute(sql, (*params, limit + 1)).fetchall()
+
+        next_cursor = encode_cursor(*rows[limit - 1][:2]) if len(rows) > limit else None
+        return [json.loads(row[2]) for row in rows[:limit]], next_cursor
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,188 @@
+"""
+In-process background job queue for ingest and training.
+
+Jobs are rows in a small SQLite file, written before they are queued, so
+anything still queued or interrupted mid-run is queued again when the
+server restarts. A fixed number of asyncio workers take jobs from a
+priority queue (lower priority value first, then submission order);
+handlers push blocking work to the threadpool themselves. Submitting
+fails with QueueFull once JOB_QUEUE_MAX jobs are waiting, which is the
+backpressure signal for clients.
+
+Handlers are registered per job kind with @job_queue.handler(kind) and
+called as `await handler(params, report)`, where report(message) records a
+progress message from any thread.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from .config import JOBS_DB, JOB_WORKERS, JOB_QUEUE_MAX, JOB_RETENTION_SECONDS
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    id         TEXT UNIQUE NOT NULL,
+    kind       TEXT NOT NULL,
+    priority   INTEGER NOT NULL,
+    status     TEXT NOT NULL,
+    message    TEXT,
+    params     TEXT NOT NULL,
+    result     TEXT,
+    error      TEXT,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+
+class QueueFull(Exception):
+    pass
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class JobQueue:
+    def __init__(self, path: str = JOBS_DB, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_MAX):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.handlers = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.queue = None
+        self.changed = None
+        self.version = 0  # bumped on every job update, for watch()
+        self.tasks = []
+        self.loop = None
+
+    def handler(self, kind: str):
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.PriorityQueue()
+        self.changed = asyncio.Condition()
+
+        with self.lock:
+            self.db.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                            (*FINISHED, now_ms() - JOB_RETENTION_SECONDS * 1000))
+            # Jobs that were running when the server stopped start over
+            self.db.execute("UPDATE jobs SET status = ?, message = 'requeued after restart' WHERE status = ?",
+                            (QUEUED, RUNNING))
+            pending = self.db.execute("SELECT priority, seq, id FROM jobs WHERE status = ?",
+                                      (QUEUED,)).fetchall()
+        for entry in pending:
+            self.queue.put_nowait(tuple(entry))
+        if pending:
+            print(f"[jobs] Requeued {len(pending)} jobs")
+
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, kind: str, params: dict, priority: int = 100) -> dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self.queue.qsize() >= self.max_queued:
+            raise QueueFull(f"Job queue is full ({self.max_queued} waiting)")
+
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (id, kind, priority, status, params, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, priority, QUEUED, json.dumps(params), now_ms(), now_ms()),
+            )
+        self.queue.put_nowait((priority, cursor.lastrowid, job_id))
+        return self.get(job_id)
+
+    def get(self, job_id: str):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, kind, priority, status, message, result, error, created_at, updated_at"
+                " FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "kind", "priority", "status", "message", "result", "error", "created_at", "updated_at")
+        job = dict(zip(keys, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    async def _update(self, job_id: str, **fields):
+        fields["updated_at"] = now_ms()
+        with self.lock:
+            self.db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                            (*fields.values(), job_id))
+        self.version += 1
+        async with self.changed:
+            self.changed.notify_all()
+
+    def _reporter(self, job_id: str):
+        def report(message: str):
+            # Callable from worker threads as well as the event loop
+            update = lambda: asyncio.ensure_future(self._update(job_id, message=message))
+            self.loop.call_soon_threadsafe(update)
+        return report
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self.queue.get()
+            with self.lock:
+                row = self.db.execute("SELECT kind, params, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[2] != QUEUED:
+                continue
+            kind, params, _ = row
+
+            await self._update(job_id, status=RUNNING, message=None)
+            try:
+                result = await self.handlers[kind](json.loads(params), self._reporter(job_id))
+                await self._update(job_id, status=DONE, result=json.dumps(result))
+                print(f"[jobs] {kind} job {job_id} done")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[jobs] {kind} job {job_id} failed: {e}")
+                await self._update(job_id, status=FAILED, error=str(e))
+
+    async def watch(self, job_id: str):
+        """
+        Yield the job every time it changes, until it finishes.
+        """
+        last = None
+        seen = -1
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.version != seen)
+                seen = self.version
+            job = self.get(job_id)
+            if job is None:
+                return
+            if job != last:
+                yield job
+                last = job
+            if job["status"] in FINISHED:
+                return
+
+
+job_queue = JobQueue()
@@ -0,0 +1,105 @@
+"""
+Dataset and model lineage graph.
+
+Nodes are "dataset:<merkle root>" and "model:<request hash>". Edges are
+    derived  parent dataset -> child dataset (a new version)
+    trained  dataset -> model
+and are stored in the lineage_edges table next to the training history.
+Nothing is loaded up front: walks go level by level with lookups on the
+(src, ...) primary key going down and the (dst, ...) index going up, so
+a query reads only the reachable part of the graph, in time proportional
+to the result, whatever the size of the table.
+"""
+import sqlite3
+import threading
+import time
+
+from .config import HISTORY_DB
+
+DERIVED = "derived"
+TRAINED = "trained"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lineage_edges (
+    src        TEXT NOT NULL,
+    dst        TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (src, dst, kind)
+);
+CREATE INDEX IF NOT EXISTS lineage_edges_dst ON lineage_edges (dst, src, kind);
+"""
+
+# Nodes looked up per query, below SQLite's bound-parameter limit
+LOOKUP_BATCH = 500
+
+
+def dataset_node(merkle_root: str) -> str:
+    return f"dataset:{merkle_root}"
+
+
+def model_node(request_hash: str) -> str:
+    return f"model:{request_hash}"
+
+
+class LineageGraph:
+    def __init__(self, path: str = HISTORY_DB):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def add_edge(self, src: str, dst: str, kind: str):
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO lineage_edges (src, dst, kind, created_at) VALUES (?, ?, ?, ?)",
+                            (src, dst, kind, int(time.time() * 1000)))
+
+    def add_version(self, parent_root: str, child_root: str):
+        self.add_edge(dataset_node(parent_root), dataset_node(child_root), DERIVED)
+
+    def add_training(self, merkle_root: str, request_hash: str):
+        self.add_edge(dataset_node(merkle_root), model_node(request_hash), TRAINED)
+
+    def walk(self, node: str, direction: str = "down", kinds=None, max_depth: int | None = None):
+        """
+        Edges reachable from `node` going down (towards children and
+        models) or up (towards parents), breadth first, as
+        (src, dst, kind) tuples.
+        """
+        # Look nodes up by the column on the near side of the edge
+        near, far = ("src", "dst") if direction == "down" else ("dst", "src")
+        edges = []
+        seen = {node}
+        level = [node]
+        depth = 0
+        with self.lock:
+            while level and (max_depth is None or depth < max_depth):
+                following = []
+                for i in range(0, len(level), LOOKUP_BATCH):
+                    batch = level[i:i + LOOKUP_BATCH]
+                    rows = self.db.execute(
+                        f"SELECT {near}, {far}, kind FROM lineage_edges"
+                        f" WHERE {near} IN ({', '.join('?' * len(batch))})", batch)
+                    for current, other, kind in rows:
+                        if kinds is not None and kind not in kinds:
+                            continue
+                        edges.append((current, other, kind) if direction == "down" else (other, current, kind))
+                        if other not in seen:
+                            seen.add(other)
+                            following.append(other)
+                level = following
+                depth += 1
+        return edges
+
+    def models_for_dataset(self, merkle_root: str, transitive: bool = True):
+        # Models trained on this dataset, or on any version derived from it
+        edges = self.walk(dataset_node(merkle_root), "down", max_depth=None if transitive else 1)
+        return sorted({dst.split(":", 1)[1] for _, dst, kind in edges if kind == TRAINED})
+
+    def datasets_for_model(self, request_hash: str):
+        # The model's training datasets followed by all their ancestors
+        edges = self.walk(model_node(request_hash), "up")
+        return list(dict.fromkeys(src.split(":", 1)[1] for src, _, _ in edges if src.startswith("dataset:")))
+
+
+lineage = LineageGraph()
@@ -0,0 +1,84 @@
+"""
+Chunk manifests for datasets stored as references into other blobs.
+
+A manifest describes a dataset version as an ordered list of segments,
+each a run of consecutive chunks read from one Walrus blob:
+
+    {"blob_id": ..., "blob_offset": ..., "length": ...,
+     "first_chunk": ..., "chunk_count": ...}
+
+Concatenating the segments in order reproduces the dataset whose Merkle
+root the manifest is filed under.
+"""
+import json
+import os
+
+from .config import MANIFEST_DIR
+from .walrus_upload import stream_blob
+
+
+class ManifestStore:
+    def __init__(self, directory: str = MANIFEST_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, merkle_root: str) -> str:
+        return os.path.join(self.directory, f"{merkle_root}.json")
+
+    def get(self, merkle_root: str):
+        try:
+            with open(self.path(merkle_root)) as f:
+                return json.load(f)
+        except (FileNotFoundError, OSError):
+            return None
+
+    def put(self, manifest: dict):
+        path = self.path(manifest["merkle_root"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+
+def append_chunk(segments: list, blob_id, blob_offset: int, length: int, index: int):
+    """
+    Add chunk `index` to the segment list, extending the last segment when
+    the chunk directly follows it in the same blob.
+    """
+    if segments:
+        last = segments[-1]
+        if (last["blob_id"] == blob_id
+                and last["blob_offset"] + last["length"] == blob_offset
+                and last["first_chunk"] + last["chunk_count"] == index):
+            last["length"] += length
+            last["chunk_count"] += 1
+            return
+    segments.append({
+        "blob_id": blob_id,
+        "blob_offset": blob_offset,
+        "length": length,
+        "first_chunk": index,
+        "chunk_count": 1,
+    })
+
+
+def chunk_locations(manifest: dict, tree):
+    """
+    Yield (index, blob_id, blob_offset) for every chunk of a manifest,
+    using the dataset's stored Merkle tree for chunk offsets.
+    """
+    for segment in manifest["segments"]:
+        first = segment["first_chunk"]
+        base = tree.chunk_offset(first)
+        for index in range(first, first + segment["chunk_count"]):
+            yield (index, segment["blob_id"],
+                   segment["blob_offset"] + tree.chunk_offset(index) - base)
+
+
+def read_manifest(manifest: dict):
+    # Stream the dataset back by fetching each segment's byte range.
+    for segment in manifest["segments"]:
+        yield from stream_blob(segment["blob_id"], start=segment["blob_offset"], length=segment["length"])
+
+
+manifests = ManifestStore()
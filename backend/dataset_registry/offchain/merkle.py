@@ -1,20 +1,51 @@
 import hashlib
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-def chunk_file(path, chunk_size=1024 * 1024):
+CHUNK_SIZE = 1024 * 1024
+
+def chunk_file(path, chunk_size=CHUNK_SIZE):
   with open(path, "rb") as f:
-    while True:
-      chunk = f.read(chunk_size)
-      if not chunk:
+    yield from chunk_stream(f, chunk_size)
+
+def rechunk(pieces, chunk_size=CHUNK_SIZE):
+  # Regroup arbitrarily sized pieces (e.g. an HTTP body) into leaf-sized chunks.
+  buf = bytearray()
+  for piece in pieces:
+    if not buf and len(piece) == chunk_size:
+      yield bytes(piece)
+      continue
+    buf += piece
+    while len(buf) >= chunk_size:
+      yield bytes(buf[:chunk_size])
+      del buf[:chunk_size]
+  if buf:
+    yield bytes(buf)
+
+def chunk_stream(f, chunk_size=CHUNK_SIZE):
+  # Short reads (pipes, sockets, request bodies) are topped up so that leaf
+  # boundaries never depend on how the bytes happened to arrive.
+  while True:
+    chunk = f.read(chunk_size)
+    if not chunk:
+      break
+    while len(chunk) < chunk_size:
+      more = f.read(chunk_size - len(chunk))
+      if not more:
         break
-      yield chunk
+      chunk += more
+    yield chunk
 
 def hash(data: bytes):
   return hashlib.sha256(data).digest()
 
 def build_merkle(chunks):
-  leaves = [hash(c) for c in chunks]
+  return build_merkle_from_leaves([hash(c) for c in chunks])
+
+def build_merkle_from_leaves(leaves):
   if len(leaves) == 1:
-    return leaves[0], [leaves[0]]
+    return leaves[0], [leaves]
 
   level = leaves
   tree = [level]
@@ -31,3 +62,190 @@ def build_merkle(chunks):
 
   root = tree[-1][0]
   return root, tree
+
+def hash_pair(left: bytes, right: bytes):
+  h = hashlib.sha256(left)
+  h.update(right)
+  return h.digest()
+
+def subtree_root(leaves, height):
+  """
+  Node `height` levels above a run of leaves that starts on a multiple of
+  2**height. For a short final run this still pairs odd nodes with
+  themselves up to `height`, matching the node build_merkle puts there.
+  """
+  level = list(leaves)
+  for _ in range(height):
+    level = [hash_pair(level[i], level[i + 1] if i + 1 < len(level) else level[i])
+             for i in range(0, len(level), 2)]
+  return level[0]
+
+def combine_subroots(subroots):
+  # Dataset root from consecutive subtree roots of equal height.
+  return build_merkle_from_leaves(list(subroots))[0]
+
+def get_proof(tree, index):
+  """
+  Inclusion proof for leaf `index`: the sibling digest on every level from
+  the leaves up to (not including) the root. `tree` is the level list
+  returned by build_merkle.
+  """
+  if not 0 <= index < len(tree[0]):
+    raise IndexError(f"Chunk index {index} out of range for {len(tree[0])} chunks")
+
+  proof = []
+  for level in tree[:-1]:
+    sibling = index ^ 1
+    # The last node of an odd level is paired with itself.
+    proof.append(level[sibling] if sibling < len(level) else level[index])
+    index //= 2
+  return proof
+
+def tree_height(leaf_count):
+  # Number of levels above the leaves, i.e. the length of every proof.
+  return (leaf_count - 1).bit_length()
+
+def verify_proof(root, leaf_count, index, chunk, proof):
+  return verify_proofs(root, leaf_count, [(index, chunk, proof)])[0]
+
+def verify_proofs(root, leaf_count, items):
+  """
+  Check many (index, chunk, proof) triples against one root of a tree
+  with `leaf_count` leaves (the `chunks` returned by /api/proofs).
+
+  The leaf count is needed because the last node of an odd level is paired
+  with itself: without it a proof for the last chunk would also verify at
+  the index one past the end. Indices outside the tree and proofs of the
+  wrong length are rejected.
+
+  Nodes on paths that already verified are remembered, so a proof stops
+  as soon as it reaches a node shared with an earlier one instead of
+  hashing all the way to the root again.
+  """
+  height = tree_height(leaf_count)
+  known = {}
+  results = []
+  for index, chunk, proof in items:
+    if not 0 <= index < leaf_count or len(proof) != height:
+      results.append(False)
+      continue
+
+    node = hash(chunk)
+    position = index
+    path = []
+    valid = None
+    for level, sibling in enumerate(proof):
+      cached = known.get((level, position))
+      if cached is not None:
+        valid = cached == node
+        break
+      path.append((level, position, node))
+      if position % 2 == 0:
+        node = hash_pair(node, sibling)
+      else:
+        node = hash_pair(sibling, node)
+      position //= 2
+    if valid is None:
+      valid = node == root
+
+    if valid:
+      for level, position, digest in path:
+        known[(level, position)] = digest
+    results.append(valid)
+  return results
+
+class MerkleBuilder:
+  """
+  Incremental Merkle root over a stream of chunks.
+
+  Only the frontier is kept: frontier[h] is the root of a complete subtree
+  of 2**h leaves still waiting for its right sibling, so memory is
+  O(log n). finalize() returns the same root as build_merkle, including
+  its rule of pairing the last node of an odd level with itself.
+  """
+
+  def __init__(self):
+    self.frontier = []
+    self.leaf_count = 0
+
+  def update(self, chunk: bytes):
+    self.update_leaf(hash(chunk))
+
+  def update_leaf(self, node: bytes):
+    self.leaf_count += 1
+    height = 0
+    while height < len(self.frontier) and self.frontier[height] is not None:
+      node = hash_pair(self.frontier[height], node)
+      self.frontier[height] = None
+      height += 1
+    if height == len(self.frontier):
+      self.frontier.append(node)
+    else:
+      self.frontier[height] = node
+
+  def finalize(self):
+    if self.leaf_count == 0:
+      raise ValueError("Cannot build a Merkle root without any chunks")
+
+    # Walk up from the leaves; `carry` is the right-most (incomplete) node of
+    # the current level, `width` is the number of nodes on that level.
+    carry = None
+    width = self.leaf_count
+    height = 0
+    while width > 1:
+      full = self.frontier[height] if height < len(self.frontier) else None
+      if full is not None and carry is not None:
+        carry = hash_pair(full, carry)
+      elif full is not None:
+        carry = hash_pair(full, full)
+      elif carry is not None:
+        carry = hash_pair(carry, carry)
+      width = (width + 1) // 2
+      height += 1
+
+    if carry is not None:
+      return carry
+    return self.frontier[height]
+
+def hash_file_leaves(source, chunk_size=CHUNK_SIZE, workers=None, batch=64, offset=0):
+  """
+  Yield the leaf digests of a file, from `offset` on, in order, hashing on
+  a thread pool. `source` is a path or an open file; an open file's
+  position is left alone.
+
+  The file is memory-mapped and each task hashes `batch` consecutive
+  chunks straight out of the mapping; hashlib drops the GIL for buffers
+  this size, so the work spreads across cores.
+  """
+  if isinstance(source, (str, bytes, os.PathLike)):
+    with open(source, "rb") as f:
+      yield from hash_file_leaves(f, chunk_size, workers, batch, offset)
+    return
+
+  size = os.fstat(source.fileno()).st_size
+  if size <= offset:
+    return
+
+  def hash_range(start):
+    end = min(start + batch * chunk_size, size)
+    return [hashlib.sha256(view[off:min(off + chunk_size, end)]).digest()
+            for off in range(start, end, chunk_size)]
+
+  with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+    view = memoryview(mm)
+    try:
+      with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for digests in pool.map(hash_range, range(offset, size, batch * chunk_size)):
+          yield from digests
+    finally:
+      view.release()
+
+def build_merkle_from_file(path, chunk_size=CHUNK_SIZE, workers=None):
+  """
+  Parallel equivalent of build_merkle(chunk_file(path)) returning
+  (root, leaf_count) without keeping the tree.
+  """
+  builder = MerkleBuilder()
+  for leaf in hash_file_leaves(path, chunk_size, workers):
+    builder.update_leaf(leaf)
+  return builder.finalize(), builder.leaf_count
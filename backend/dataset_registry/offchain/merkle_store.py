@@ -0,0 +1,244 @@
+"""
+On-disk Merkle trees.
+
+File layout (little endian):
+
+    header   magic "CTMT" | u16 version | u16 chunker | u64 chunk_size
+             | u64 leaf_count | 32-byte root | u64 min_size | u64 max_size
+    nodes    32-byte digests, level by level from the leaves up to the root
+    offsets  content-defined chunking only: u64 end offset of every leaf
+
+Level widths follow from leaf_count alone (each level is ceil(prev / 2)),
+so any node is found by arithmetic and read straight out of an mmap.
+Version 1 files have the same layout without min_size/max_size and are
+always fixed-size chunking.
+"""
+import hashlib
+import mmap
+import os
+import shutil
+import string
+import struct
+import tempfile
+
+from .chunking import FIXED, chunker_for
+from .config import MERKLE_STORE_DIR
+from .merkle import hash_pair
+
+MAGIC = b"CTMT"
+VERSION = 2
+HEADER_V1 = struct.Struct("<4sHHQQ32s")
+HEADER = struct.Struct("<4sHHQQ32sQQ")
+NODE_SIZE = 32
+OFFSET = struct.Struct("<Q")
+
+
+def level_widths(leaf_count: int):
+    widths = [leaf_count]
+    while widths[-1] > 1:
+        widths.append((widths[-1] + 1) // 2)
+    return widths
+
+
+class MerkleTreeWriter:
+    """
+    Streams leaf digests to a temp file and, on finalize(), appends every
+    upper level by reading the level below back from disk. Memory stays
+    constant whatever the dataset size.
+    """
+
+    def __init__(self, store: "MerkleStore", chunker):
+        self.store = store
+        self.chunker = chunker
+        self.leaf_count = 0
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.directory, suffix=".tmp")
+        self.f = os.fdopen(fd, "w+b")
+        self.f.write(self._header(bytes(NODE_SIZE)))
+        # Variable-size leaves need their offsets; they are spooled aside
+        # and appended after the nodes once the node count is known.
+        self.offsets = tempfile.TemporaryFile() if chunker.variable else None
+
+    def _header(self, root: bytes):
+        return HEADER.pack(MAGIC, VERSION, self.chunker.kind, self.chunker.chunk_size,
+                           self.leaf_count, root, self.chunker.min_size, self.chunker.max_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+    def add_leaf(self, digest: bytes, length: int | None = None):
+        self.f.write(digest)
+        self.leaf_count += 1
+        if self.offsets is not None:
+            self.size += length
+            self.offsets.write(OFFSET.pack(self.size))
+
+    def finalize(self) -> bytes:
+        if self.leaf_count == 0:
+            self.abort()
+            raise ValueError("Cannot build a Merkle root without any chunks")
+
+        fd = self.f.fileno()
+        offset = HEADER.size
+        block = 4096 * 2 * NODE_SIZE
+        for width in level_widths(self.leaf_count)[:-1]:
+            self.f.flush()
+            end = offset + width * NODE_SIZE
+            for start in range(offset, end, block):
+                data = os.pread(fd, min(block, end - start), start)
+                for i in range(0, len(data), 2 * NODE_SIZE):
+                    left = data[i:i + NODE_SIZE]
+                    right = data[i + NODE_SIZE:i + 2 * NODE_SIZE] or left
+                    self.f.write(hash_pair(left, right))
+            offset = end
+
+        self.f.flush()
+        root = os.pread(fd, NODE_SIZE, offset)
+        if self.offsets is not None:
+            self.offsets.seek(0)
+            shutil.copyfileobj(self.offsets, self.f)
+            self.offsets.close()
+        self.f.seek(0)
+        self.f.write(self._header(root))
+        self.f.flush()
+        os.fsync(fd)
+        self.f.close()
+        os.replace(self.tmp_path, self.store.tree_path(root.hex()))
+        return root
+
+    def abort(self):
+        if not self.f.closed:
+            self.f.close()
+        if self.offsets is not None and not self.offsets.closed:
+            self.offsets.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class _Level:
+    def __init__(self, mm, offset: int, width: int):
+        self.mm = mm
+        self.offset = offset
+        self.width = width
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, index: int) -> bytes:
+        if not 0 <= index < self.width:
+            raise IndexError(index)
+        start = self.offset + index * NODE_SIZE
+        return self.mm[start:start + NODE_SIZE]
+
+
+class StoredTree:
+    """
+    Read-only, mmap-backed view of a stored tree. `levels` has the same
+    shape as the tree returned by merkle.build_merkle, so it can be passed
+    to merkle.get_proof directly.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = struct.unpack_from("<4sH", self.mm)
+        if magic != MAGIC or version not in (1, VERSION):
+            self.mm.close()
+            raise ValueError(f"Not a Merkle tree file: {path}")
+
+        if version == 1:
+            _, _, kind, chunk_size, self.leaf_count, self.root = HEADER_V1.unpack_from(self.mm)
+            min_size = max_size = chunk_size
+            offset = HEADER_V1.size
+        else:
+            _, _, kind, chunk_size, self.leaf_count, self.root, min_size, max_size = HEADER.unpack_from(self.mm)
+            offset = HEADER.size
+        self.chunker = chunker_for(kind, chunk_size, min_size, max_size)
+        self.chunk_size = chunk_size
+
+        self.levels = []
+        for width in level_widths(self.leaf_count):
+            self.levels.append(_Level(self.mm, offset, width))
+            offset += width * NODE_SIZE
+        self.offsets_at = offset if kind != FIXED else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+
+    def chunk_offset(self, index: int) -> int:
+        """
+        Byte offset of chunk `index` in the dataset (index == leaf_count
+        gives the end of the last chunk for content-defined trees).
+        """
+        if self.offsets_at is None:
+            return index * self.chunk_size
+        if index == 0:
+            return 0
+        return OFFSET.unpack_from(self.mm, self.offsets_at + (index - 1) * OFFSET.size)[0]
+
+
+class MerkleStore:
+    """
+    Directory of tree files named by Merkle root, plus small `.ref` files
+    mapping dataset ids to roots.
+    """
+
+    def __init__(self, directory: str = MERKLE_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def tree_path(self, root_hex: str) -> str:
+        return os.path.join(self.directory, f"{root_hex}.mtree")
+
+    def ref_path(self, dataset_id_hex: str) -> str:
+        return os.path.join(self.directory, f"{dataset_id_hex}.ref")
+
+    def writer(self, chunker) -> MerkleTreeWriter:
+        return MerkleTreeWriter(self, chunker)
+
+    def blob_key(self, blob_id: str, chunk_size: int) -> str:
+        """
+        Key under which the tree rebuilt from a Walrus blob at chunk_size
+        is linked. Blob ids are not hex and one blob can be rebuilt at
+        several chunk sizes, so the key is a digest of both.
+        """
+        return hashlib.sha256(f"{blob_id}:{chunk_size}".encode()).hexdigest()
+
+    def link(self, dataset_id_hex: str, root_hex: str):
+        with open(self.ref_path(dataset_id_hex), "w") as f:
+            f.write(root_hex)
+
+    def resolve(self, key: str):
+        """
+        Return the root hex for a Merkle root or dataset id, or None.
+        """
+        key = key.lower().removeprefix("0x")
+        if not key or any(c not in string.hexdigits for c in key):
+            return None
+        if os.path.exists(self.tree_path(key)):
+            return key
+        try:
+            with open(self.ref_path(key)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def open(self, key: str):
+        root_hex = self.resolve(key)
+        if root_hex is None or not os.path.exists(self.tree_path(root_hex)):
+            return None
+        return StoredTree(self.tree_path(root_hex))
+
+
+store = MerkleStore()
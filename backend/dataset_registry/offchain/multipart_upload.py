@@ -0,0 +1,83 @@
+"""
+Sharded Walrus uploads for large datasets.
+
+The dataset is cut into parts of `part_chunks` Merkle chunks (a power of
+two), each uploaded as its own blob on a bounded thread pool with per-part
+retries. Because parts start on a multiple of 2**k leaves, each part's
+subroot is a node of the dataset's Merkle tree, and
+merkle.combine_subroots(subroots) gives back the dataset root.
+
+The returned segments use the manifest.py format (plus "subroot"), so a
+multipart dataset is stored and downloaded like any other manifest.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .merkle import chunk_stream, hash as hash_chunk, subtree_root
+from .walrus_upload import put_blob_with_retry
+
+PART_CHUNKS = 16
+MAX_WORKERS = 4
+
+
+def upload_multipart(stream, tree, part_chunks: int = PART_CHUNKS, max_workers: int = MAX_WORKERS,
+                     retries: int = 3, backoff: float = 1.0, publisher: str | None = None):
+    """
+    Upload `stream` (positioned at the dataset start) in parts, checking
+    every part against `tree`, the dataset's stored fixed-size Merkle tree.
+    At most `max_workers` parts are held in memory at once.
+    """
+    if part_chunks & (part_chunks - 1):
+        raise ValueError("part_chunks must be a power of two")
+    if tree.chunker.variable:
+        raise ValueError("Multipart upload needs fixed-size chunking")
+
+    # With a single part the subroot is the dataset root itself
+    height = min(part_chunks.bit_length() - 1, len(tree.levels) - 1)
+    part_bytes = part_chunks * tree.chunk_size
+    slots = threading.BoundedSemaphore(max_workers)
+    failed = threading.Event()
+
+    def upload_part(index, offset, data):
+        try:
+            leaves = [hash_chunk(c) for c in _split(data, tree.chunk_size)]
+            subroot = subtree_root(leaves, height)
+            if subroot != tree.levels[height][index]:
+                raise Exception(f"Part {index} does not match the dataset's Merkle tree")
+
+            blob_info = put_blob_with_retry(data, retries, backoff, publisher)
+            print(f"[multipart] part {index} ({len(data)} bytes) -> {blob_info['blob_id']}")
+            return {
+                "blob_id": blob_info["blob_id"],
+                "blob_offset": 0,
+                "length": len(data),
+                "first_chunk": index * part_chunks,
+                "chunk_count": len(leaves),
+                "offset": offset,
+                "subroot": subroot.hex(),
+            }
+        except Exception:
+            failed.set()
+            raise
+        finally:
+            slots.release()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        offset = 0
+        for index, data in enumerate(chunk_stream(stream, part_bytes)):
+            slots.acquire()
+            if failed.is_set():
+                slots.release()
+                break
+            futures.append(pool.submit(upload_part, index, offset, data))
+            offset += len(data)
+
+    # Re-raises the first part that failed for good
+    return [f.result() for f in futures]
+
+
+def _split(data: bytes, chunk_size: int):
+    view = memoryview(data)
+    for start in range(0, len(data), chunk_size):
+        yield view[start:start + chunk_size]
@@ -1,22 +1,66 @@
-import json
-from .config import SUI_PACKAGE_ID
+
+import threading
+import time
+from concurrent.futures import Future
+
+from .config import (SUI_PACKAGE_ID, SUI_BATCH_MAX_CALLS, SUI_BATCH_MAX_BYTES, SUI_BATCH_FLUSH_SECONDS,
+                     SUI_GAS_PER_REGISTRATION, SUI_MAX_GAS_BUDGET)
 from pysui import SuiConfig, SyncClient
-from pysui.sui.sui_txn.transaction_builder import ProgrammableTransactionBuilder
+from pysui.sui.sui_bcs import bcs
+from pysui.sui.sui_txn import SyncTransaction
+from pysui.sui.sui_txn.transaction_builder import PureInput
+from pysui.sui.sui_utils import serialize_uint32_as_uleb128
 
+# Rough per-call cost on top of the argument bytes (command, input
+# headers, length prefixes) when sizing a batch against the tx size limit
+CALL_OVERHEAD_BYTES = 64
 
-def register_dataset(dataset_id, blob_id, merkle_root, zk_proof):
+# The shared Clock object (0x6) that register_dataset takes after its byte arguments
+CLOCK = bcs.ObjectArg("SharedObject", bcs.SharedObjectReference(bcs.Address.from_str("0x6"), 1, False))
+
+_sui = None
+_sui_lock = threading.Lock()
+
+
+def load_sui():
   """
-  Register a dataset on Sui blockchain.
-  
-  Args:
-    dataset_id: bytes - UUID bytes for the dataset
-    blob_id: str - Walrus blob ID
-    merkle_root: bytes - Merkle root hash
-    zk_proof: bytes - Zero-knowledge proof
-  
+  Load the Sui CLI config and build the client once; every registration
+  reuses them.
+
   Returns:
-    str - Transaction digest
+    (SuiConfig, SyncClient)
   """
+  global _sui
+  with _sui_lock:
+    if _sui is not None:
+      return _sui
+
+    # Initialize SuiConfig - use default config which reads from ~/.sui/sui_config/
+    # This requires Sui CLI to be installed and configured
+    try:
+      config = SuiConfig.default_config()
+    except Exception as e:
+      raise Exception(
+        f"Failed to load Sui config. Make sure:\n"
+        f"1. Sui CLI is installed (https://docs.sui.io/build/install)\n"
+        f"2. Sui CLI is configured: run 'sui client' to set up\n"
+        f"3. You have an active address: run 'sui client active-address'\n"
+        f"Error: {e}"
+      )
+
+    # Get active address (signer)
+    signer = config.active_address
+    print(f"Using signer address: {signer}")
+
+    # Verify signer is set
+    if not signer:
+      raise Exception("No active address found. Run 'sui client active-address' to set an active address.")
+
+    _sui = (config, SyncClient(config))
+    return _sui
+
+
+def encode_blob_id(blob_id) -> bytes:
   print(f"[debug register_to_sui] blob_id type: {type(blob_id)}, value: {blob_id}")
   
   # Ensure blob_id is a string - handle all cases
@@ -48,67 +92,213 @@ def register_dataset(dataset_id, blob_id, merkle_root, zk_proof):
     blob_id_bytes = blob_id_str.encode('utf-8')
   except AttributeError as e:
     raise Exception(f"Cannot encode blob_id_str: type={type(blob_id_str)}, value={blob_id_str}, original_blob_id={blob_id}. Error: {e}")
-  
-  # Validate package ID
-  if not SUI_PACKAGE_ID or SUI_PACKAGE_ID == "REPLACE_WITH_DEPLOYED_PACKAGE":
-    raise Exception("SUI_PACKAGE_ID is not set. Please update config.py with your deployed package ID.")
-  
-  # Initialize SuiConfig - use default config which reads from ~/.sui/sui_config/
-  # This requires Sui CLI to be installed and configured
-  try:
-    config = SuiConfig.default_config()
-  except Exception as e:
-    raise Exception(
-      f"Failed to load Sui config. Make sure:\n"
-      f"1. Sui CLI is installed (https://docs.sui.io/build/install)\n"
-      f"2. Sui CLI is configured: run 'sui client' to set up\n"
-      f"3. You have an active address: run 'sui client active-address'\n"
-      f"Error: {e}"
-    )
-  
-  # Create SyncClient
-  client = SyncClient(config)
-  
-  # Get active address (signer)
-  signer = config.active_address
-  print(f"Using signer address: {signer}")
+  return blob_id_bytes
 
-  # print(dir(ProgrammableTransactionBuilder()))
-  
-  # Verify signer is set
-  if not signer:
-    raise Exception("No active address found. Run 'sui client active-address' to set an active address.")
-  
-  # Prepare arguments - all need to be hex strings with 0x prefix
-  args = [
-    dataset_id,            # bytes
-    blob_id_bytes,         # bytes
-    merkle_root,           # bytes
-    zk_proof,              # bytes
+
+def registration_args(dataset_id, blob_id, merkle_root, zk_proof):
+  # Arguments of one register_dataset move call, all bytes
+  return [
+    dataset_id,
+    encode_blob_id(blob_id),
+    merkle_root,
+    zk_proof,
     b"nautilus-dummy"
-]
+  ]
 
 
-  print(f"Calling move_call with package: {SUI_PACKAGE_ID}")
-  # print(f"Arguments: {[arg[:20] + '...' if len(arg) > 20 else arg for arg in args]}")
-  
-  try:
-    ptb = ProgrammableTransactionBuilder()
-    ptb_args = [ptb.input_pure(a) for a in args]
-    print("ptb args: ", ptb_args)
+def pure_bytes(value: bytes):
+  # A Move vector<u8> argument: BCS length prefix, then the bytes
+  return PureInput.as_input(serialize_uint32_as_uleb128(len(value)) + value)
 
 
+def add_registrations(ptb, calls):
+  # One register_dataset move call per argument list on the transaction builder
+  package = bcs.Address.from_str(SUI_PACKAGE_ID)
+  for args in calls:
     ptb.move_call(
-        target=f"{SUI_PACKAGE_ID}::dataset_registry::register_dataset",
-        arguments=ptb_args,
+        target=package,
+        module="dataset_registry",
+        function="register_dataset",
+        arguments=[pure_bytes(a) for a in args] + [CLOCK],
         type_arguments=[]
     )
 
-    ptb.set_gas_budget(20000000)
-    result = client.execute(ptb)
-    print("Transaction result:", result)
-    
-  except Exception as e:
-    error_msg = f"Failed to execute transaction: {str(e)}"
-    print(f"ERROR: {error_msg}")
-    raise Exception(error_msg)
+
+class DatasetRegistrar:
+  """
+  Packs register_dataset move calls for many datasets into one programmable
+  transaction.
+
+  submit() queues a registration and returns a Future for its transaction
+  digest. A batch is sent once it reaches max_calls calls or max_bytes of
+  arguments, or flush_seconds after its first registration was queued,
+  whichever comes first. Batches are sent one at a time, so they never
+  compete for the signer's gas coin; a failed batch fails every Future in
+  it.
+
+  `client` defaults to the shared client from load_sui(); pass a stub to
+  run without a Sui node.
+  """
+
+  def __init__(self, client=None, max_calls: int = SUI_BATCH_MAX_CALLS, max_bytes: int = SUI_BATCH_MAX_BYTES,
+               flush_seconds: float = SUI_BATCH_FLUSH_SECONDS, gas_per_call: int = SUI_GAS_PER_REGISTRATION,
+               max_gas: int = SUI_MAX_GAS_BUDGET):
+    self.client = client
+    # The gas budget of a batch grows with its size and is capped by max_gas
+    self.max_calls = max(1, min(max_calls, max_gas // gas_per_call))
+    self.max_bytes = max_bytes
+    self.flush_seconds = flush_seconds
+    self.gas_per_call = gas_per_call
+    self.max_gas = max_gas
+    self.pending = []  # (args, size, future), oldest first
+    self.pending_bytes = 0
+    self.oldest = None
+    self.lock = threading.Lock()
+    self.wakeup = threading.Condition(self.lock)
+    self.send_lock = threading.Lock()
+    self.thread = None
+    self.closed = False
+    self.batches = self.registered = self.failed = 0
+
+  def submit(self, dataset_id, blob_id, merkle_root, zk_proof) -> Future:
+    # Validate package ID
+    if not SUI_PACKAGE_ID or SUI_PACKAGE_ID == "REPLACE_WITH_DEPLOYED_PACKAGE":
+      raise Exception("SUI_PACKAGE_ID is not set. Please update config.py with your deployed package ID.")
+
+    args = registration_args(dataset_id, blob_id, merkle_root, zk_proof)
+    size = sum(len(a) for a in args) + CALL_OVERHEAD_BYTES
+    if size > self.max_bytes:
+      raise Exception(f"Registration is {size} bytes, over the {self.max_bytes} byte batch limit")
+
+    future = Future()
+    with self.lock:
+      if self.closed:
+        raise Exception("Registrar is closed")
+      if not self.pending:
+        self.oldest = time.monotonic()
+      self.pending.append((args, size, future))
+      self.pending_bytes += size
+      if self.thread is None:
+        self.thread = threading.Thread(target=self._run, name="sui-registrar", daemon=True)
+        self.thread.start()
+      self.wakeup.notify()
+    return future
+
+  def _due(self) -> bool:
+    if not self.pending:
+      return False
+    return (self.closed
+            or len(self.pending) >= self.max_calls
+            or self.pending_bytes >= self.max_bytes
+            or time.monotonic() - self.oldest >= self.flush_seconds)
+
+  def _take(self):
+    # Oldest registrations that fit in one transaction
+    count = size = 0
+    for _, entry_size, _ in self.pending[:self.max_calls]:
+      if size + entry_size > self.max_bytes:
+        break
+      count += 1
+      size += entry_size
+    batch = self.pending[:count]
+    del self.pending[:count]
+    self.pending_bytes -= size
+    if not self.pending:
+      self.oldest = None
+    return batch
+
+  def _run(self):
+    while True:
+      with self.lock:
+        while not self._due():
+          if self.closed:
+            return
+          timeout = None if self.oldest is None else max(0, self.oldest + self.flush_seconds - time.monotonic())
+          self.wakeup.wait(timeout)
+      self._send_next()
+
+  def _send_next(self) -> bool:
+    with self.send_lock:
+      with self.lock:
+        batch = self._take()
+      if not batch:
+        return False
+      try:
+        digest = self._execute([args for args, _, _ in batch])
+      except Exception as e:
+        self.failed += len(batch)
+        for _, _, future in batch:
+          future.set_exception(e)
+      else:
+        self.batches += 1
+        self.registered += len(batch)
+        for _, _, future in batch:
+          future.set_result(digest)
+      return True
+
+  def _execute(self, calls) -> str:
+    client = self.client if self.client is not None else load_sui()[1]
+    print(f"Calling move_call with package: {SUI_PACKAGE_ID} ({len(calls)} registrations)")
+
+    try:
+      txn = SyncTransaction(client=client)
+      add_registrations(txn.builder, calls)
+      result = txn.execute(gas_budget=str(min(self.gas_per_call * len(calls), self.max_gas)))
+      print("Transaction result:", result)
+      if not result.is_ok():
+        raise Exception(result.result_string)
+      return result.result_data.digest
+
+    except Exception as e:
+      error_msg = f"Failed to execute transaction: {str(e)}"
+      print(f"ERROR: {error_msg}")
+      raise Exception(error_msg)
+
+  def flush(self):
+    """
+    Send everything queued so far, without waiting for the thresholds.
+    """
+    while self._send_next():
+      pass
+
+  def close(self):
+    # Sends what is still queued, then stops the sender thread
+    with self.lock:
+      self.closed = True
+      self.wakeup.notify()
+      thread = self.thread
+    if thread is not None:
+      thread.join()
+    self.flush()
+
+  def stats(self):
+    with self.lock:
+      queued = len(self.pending)
+    return {
+      "queued": queued,
+      "batches": self.batches,
+      "registered": self.registered,
+      "failed": self.failed,
+    }
+
+
+registrar = DatasetRegistrar()
+
+
+def register_dataset(dataset_id, blob_id, merkle_root, zk_proof):
+  """
+  Register a dataset on Sui blockchain, sending it together with any other
+  registrations queued on the shared registrar. Blocks until its batch is
+  sent: when the batch fills up, or SUI_BATCH_FLUSH_SECONDS after the
+  oldest registration in it was queued.
+  
+  Args:
+    dataset_id: bytes - UUID bytes for the dataset
+    blob_id: str - Walrus blob ID
+    merkle_root: bytes - Merkle root hash
+    zk_proof: bytes - Zero-knowledge proof
+  
+  Returns:
+    str - Transaction digest
+  """
+  return registrar.submit(dataset_id, blob_id, merkle_root, zk_proof).result()
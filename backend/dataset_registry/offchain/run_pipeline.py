@@ -1,47 +1,424 @@
-from .walrus_upload import upload_to_walrus
-from .merkle import chunk_file, build_merkle
+from .walrus_upload import upload_stream_to_walrus, blob_exists
+from .merkle import chunk_stream, hash_file_leaves, hash as hash_chunk, combine_subroots
+from .chunking import FixedChunker
+from .dataset_hash import dataset_hashes, sha256_stream
+from .merkle_store import store as merkle_store
+from .blob_index import blob_index
+from .manifest import manifests, append_chunk, chunk_locations
+from .multipart_upload import upload_multipart
+from .lineage import lineage
+from .stages import Stage, stage_timings
 from .nautilus_proof import Nautilus
 from .register_to_sui import register_dataset
+import hashlib
+import stat
+import tempfile
+import time
 import uuid
 import os
 
-def process_dataset(path: str):
+def process_dataset(path: str, workers: int | None = None, chunker=None, multipart: bool = False):
+    # The file's SHA-256 is cached by stat, so re-ingesting it costs no extra pass
+    content_hash = dataset_hashes.compute(path)
+    with open(path, "rb") as f:
+        return process_stream(f, chunker, multipart, content_hash, workers)
+
+def process_stream(stream, chunker=None, multipart: bool = False, content_hash: str | None = None,
+                   workers: int | None = None):
+    """
+    Ingest a file-like object. The dedup key is the SHA-256 of the content
+    (`content_hash`, or computed in a first pass over the data), so stored
+    content is recognised before any tree is built or byte uploaded. New
+    content is then read once, with each chunk handed to both the Merkle
+    stage and the upload stage so hashing and uploading run concurrently.
+    A stream that cannot seek back is spooled to a temp file while its key
+    is computed. With fixed-size chunks and a real file underneath (a path,
+    the spool, an upload spooled past memory), the leaves are instead
+    hashed on all cores straight from the page cache while the upload
+    reads the file.
+    With `multipart` the data is uploaded in parallel parts (see
+    multipart_upload.py) once the tree is built, since each part is
+    checked against its subroot.
+    """
+    chunker = chunker or FixedChunker()
+    if multipart and chunker.variable:
+        raise ValueError("Multipart upload needs fixed-size chunking")
+
+    started = time.perf_counter()
+    digest = Stage("digest")
+    read = Stage("read")
+    merkle = Stage("merkle")
+    upload = Stage("upload")
+
+    # Create dataset ID
+    dataset_id = uuid.uuid4().bytes
+
+    source, start, file_size, content_hash, spool = digest.run(keyed_source, stream, content_hash)
+    try:
+        # 1. Same content as something already stored: nothing to hash or upload
+        stored = stored_content(content_hash, chunker)
+        if stored is not None:
+            root, leaf_count, blob_info, manifest = stored
+            print(f"[dedup] {content_hash} already stored as {root.hex()}, skipping upload")
+            return finish_dataset(dataset_id, blob_info, root, leaf_count, file_size, chunker, True,
+                                  manifest, stage_timings(started, digest), content_hash)
+        if file_size == 0:
+            raise ValueError("Cannot build a Merkle root without any chunks")
+
+        # 2. Merkle root, hashed on its own thread while the data is read once
+        # and, unless it goes up in parts afterwards, uploaded at the same time
+        with merkle_store.writer(chunker) as tree_writer:
+            def build(chunks):
+                for chunk in chunks:
+                    tree_writer.add_leaf(hash_chunk(chunk), len(chunk))
+                return tree_writer.finalize()
+
+            def build_mapped():
+                for leaf in merkle.watch(hash_file_leaves(source, chunker.chunk_size, workers, offset=start)):
+                    tree_writer.add_leaf(leaf)
+                return tree_writer.finalize()
+
+            def feed():
+                for chunk in read.watch(chunker.chunks(source)):
+                    merkle.put(chunk)
+                    if not multipart:
+                        upload.put(chunk)
+                merkle.close()
+                if not multipart:
+                    upload.close()
+
+            mapped = not chunker.variable and real_fileno(source) is not None
+            try:
+                if mapped:
+                    merkle.start(build_mapped)
+                    if not multipart:
+                        upload.run(upload_stream_to_walrus, upload.watch(reread(source, start)))
+                else:
+                    merkle.start(build, merkle.items())
+                    if not multipart:
+                        upload.start(upload_stream_to_walrus, upload.items())
+                    read.run(feed)
+                root = merkle.join()
+                blob_info = upload.join()
+            except BaseException:
+                merkle.cancel()
+                upload.cancel()
+                raise
+
+        if multipart:
+            blob_info, manifest = upload.run(
+                upload_parts, root, source, start, chunker, file_size, tree_writer.leaf_count)
+        else:
+            blob_index.put(root.hex(), blob_info)
+            manifest = None
+    finally:
+        if spool is not None:
+            spool.close()
+
+    return finish_dataset(dataset_id, blob_info, root, tree_writer.leaf_count, file_size,
+                          chunker, False, manifest, stage_timings(started, digest, read, merkle, upload),
+                          content_hash)
+
+def process_version(stream, parent_root: str, content_hash: str | None = None):
+    """
+    Ingest a new version of an existing dataset. Chunks whose leaf hash
+    already appears in the parent are referenced instead of re-uploaded;
+    only the new chunks go to Walrus, concatenated into one delta blob, and
+    the version is recorded as a manifest of chunk references.
+    The new version is chunked the same way as its parent. Content that is
+    already stored is recognised by its SHA-256 before anything is diffed;
+    otherwise new chunks are uploaded as the diff finds them. The version's
+    links and lineage edge are recorded only once it is stored.
+    """
+    started = time.perf_counter()
+    digest = Stage("digest")
+    merkle = Stage("merkle")
+    upload = Stage("upload")
+
     # Create dataset ID
     dataset_id = uuid.uuid4().bytes
 
-    # Get file size
-    file_size = os.path.getsize(path)
+    parent_root = merkle_store.resolve(parent_root)
+    parent_tree = merkle_store.open(parent_root) if parent_root else None
+    if parent_tree is None:
+        raise Exception(f"No stored Merkle tree for parent dataset {parent_root}")
+    with parent_tree:
+        chunker = parent_tree.chunker
+        known_chunks = parent_chunk_map(parent_root, parent_tree)
+
+    def record_version(merkle_root_hex):
+        merkle_store.link(dataset_id.hex(), merkle_root_hex)
+        merkle_store.link(content_hash, merkle_root_hex)
+        if merkle_root_hex != parent_root:
+            lineage.add_version(parent_root, merkle_root_hex)
+
+    source, start, file_size, content_hash, spool = digest.run(keyed_source, stream, content_hash)
+    try:
+        # 1. Same content as something already stored: nothing to diff, upload or record
+        stored = stored_content(content_hash, chunker)
+        if stored is not None:
+            root, leaf_count, blob_info, existing = stored
+            print(f"[dedup] {content_hash} already stored as {root.hex()}, skipping upload")
+            record_version(root.hex())
+            return {
+                'dataset_id': dataset_id.hex(),
+                'merkle_root': root.hex(),
+                'parent_root': parent_root,
+                'chunks': leaf_count,
+                'file_size': file_size,
+                'chunking': chunker.spec(),
+                'blob_info': blob_info,
+                'manifest': existing,
+                'reused_chunks': leaf_count,
+                'uploaded_chunks': 0,
+                'uploaded_bytes': 0,
+                'deduplicated': True,
+                'timings': stage_timings(started, digest),
+            }
+
+        # 2. Hash the new version and diff its leaves against the parent's.
+        # New chunks go straight to the upload stage, which streams them
+        # into the delta blob (blob_id None until uploaded).
+        segments = []
+        changed = 0
+        delta_size = 0
+
+        def diff(chunks):
+            nonlocal changed, delta_size
+            for index, chunk in enumerate(chunks):
+                leaf = hash_chunk(chunk)
+                tree_writer.add_leaf(leaf, len(chunk))
+
+                location = known_chunks.get(leaf)
+                if location is None:
+                    location = (None, delta_size)
+                    known_chunks[leaf] = location
+                    if upload.thread is None:
+                        upload.start(upload_stream_to_walrus, upload.items())
+                    upload.put(chunk)
+                    changed += 1
+                    delta_size += len(chunk)
+                append_chunk(segments, location[0], location[1], len(chunk), index)
+            if upload.thread is not None:
+                upload.close()
+            return tree_writer.finalize()
+
+        try:
+            with merkle_store.writer(chunker) as tree_writer:
+                root = merkle.run(diff, merkle.watch(chunker.chunks(source)))
+            blob_info = upload.join()
+        except BaseException:
+            upload.cancel()
+            raise
+    finally:
+        if spool is not None:
+            spool.close()
+    merkle_root_hex = root.hex()
+
+    if changed:
+        delta_blob_id = extract_blob_id(blob_info)
+        for segment in segments:
+            if segment["blob_id"] is None:
+                segment["blob_id"] = delta_blob_id
+
+    # 3. Record the version as a manifest of chunk references
+    manifest = {
+        'merkle_root': merkle_root_hex,
+        'parent_root': parent_root,
+        'chunking': chunker.spec(),
+        'file_size': file_size,
+        'chunks': tree_writer.leaf_count,
+        'segments': segments,
+    }
+    manifests.put(manifest)
+    record_version(merkle_root_hex)
+
+    print(f"[delta] {merkle_root_hex}: uploaded {changed}/{tree_writer.leaf_count} chunks ({delta_size} bytes)")
 
-    # 1. Upload to Walrus
-    blob_info = upload_to_walrus(path)
-    print(f"[debug] blob_info type: {type(blob_info)}, value: {blob_info}")
-    
+    return {
+        'dataset_id': dataset_id.hex(),
+        'merkle_root': merkle_root_hex,
+        'parent_root': parent_root,
+        'chunks': tree_writer.leaf_count,
+        'file_size': file_size,
+        'chunking': chunker.spec(),
+        'blob_info': blob_info,
+        'manifest': manifest,
+        'reused_chunks': tree_writer.leaf_count - changed,
+        'uploaded_chunks': changed,
+        'uploaded_bytes': delta_size,
+        'deduplicated': False,
+        'timings': stage_timings(started, digest, merkle, upload),
+    }
+
+def parent_chunk_map(parent_root: str, parent_tree) -> dict:
+    """
+    Map each leaf hash of the parent to (blob_id, blob_offset) of a stored
+    copy of that chunk.
+    """
+    manifest = manifests.get(parent_root)
+    if manifest is not None:
+        locations = chunk_locations(manifest, parent_tree)
+    else:
+        blob_info = blob_index.get(parent_root)
+        if blob_info is None:
+            raise Exception(f"Parent dataset {parent_root} is not in the blob index or a manifest")
+        blob_id = extract_blob_id(blob_info)
+        locations = ((i, blob_id, parent_tree.chunk_offset(i)) for i in range(parent_tree.leaf_count))
+
+    leaves = parent_tree.levels[0]
+    chunk_map = {}
+    for index, blob_id, blob_offset in locations:
+        chunk_map.setdefault(leaves[index], (blob_id, blob_offset))
+    return chunk_map
+
+def keyed_source(stream, content_hash: str | None = None):
+    """
+    Get the stream ready for ingest under its dedup key. Returns
+    (source, start, size, content_hash, spool): `source` is seekable and
+    positioned at `start`. A stream that cannot seek back is copied to a
+    temp file (`spool`, for the caller to close) while it is hashed; a
+    seekable one is read for its hash only if `content_hash` is not given.
+    """
+    spool = None
+    if is_seekable(stream):
+        source, start = stream, stream.tell()
+        if content_hash is None:
+            content_hash = sha256_stream(source)
+    else:
+        source = spool = tempfile.TemporaryFile()
+        start = 0
+        digest = hashlib.sha256()
+        for chunk in chunk_stream(stream):
+            digest.update(chunk)
+            spool.write(chunk)
+        content_hash = digest.hexdigest()
+    source.seek(0, os.SEEK_END)
+    size = source.tell() - start
+    source.seek(start)
+    return source, start, size, content_hash, spool
+
+def real_fileno(stream):
+    """
+    Descriptor of the regular file behind `stream`, or None. A
+    SpooledTemporaryFile still held in memory is left there.
+    """
+    if getattr(stream, "_rolled", True) is False:
+        return None
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    return fd if stat.S_ISREG(os.fstat(fd).st_mode) else None
+
+def reread(stream, start: int):
+    # The stream's data from `start` again, for uploading after hashing
+    stream.seek(start)
+    yield from chunk_stream(stream)
+
+def is_seekable(stream) -> bool:
+    # SpooledTemporaryFile only grew seekable() in Python 3.11
+    try:
+        return stream.seekable()
+    except AttributeError:
+        return hasattr(stream, "seek") and hasattr(stream, "tell")
+
+def stored_blob(merkle_root_hex: str):
+    """
+    blob_info of the blob already storing this root, or None. Index hits
+    are confirmed with the aggregator, and roots whose blob has expired
+    are dropped so the content is uploaded again.
+    """
+    blob_info = blob_index.get(merkle_root_hex)
+    if blob_info is None:
+        return None
+    blob_id = extract_blob_id(blob_info)
+    try:
+        if blob_exists(blob_id):
+            return blob_info
+        print(f"[dedup] blob {blob_id} for {merkle_root_hex} is no longer stored")
+        blob_index.drop(merkle_root_hex)
+    except Exception as e:
+        print(f"[dedup] could not check blob {blob_id} ({e}), uploading again")
+    return None
+
+def stored_content(content_hash: str, chunker):
+    """
+    (root, leaf_count, blob_info, manifest) of content with this SHA-256
+    already stored with the same chunking, or None.
+    """
+    merkle_root_hex = merkle_store.resolve(content_hash)
+    tree = merkle_store.open(merkle_root_hex) if merkle_root_hex else None
+    if tree is None:
+        return None
+    with tree:
+        if tree.chunker.spec() != chunker.spec():
+            return None
+        leaf_count = tree.leaf_count
+    manifest = manifests.get(merkle_root_hex)
+    blob_info = stored_blob(merkle_root_hex)
+    if manifest is None and blob_info is None:
+        return None
+    return bytes.fromhex(merkle_root_hex), leaf_count, blob_info, manifest
+
+def upload_parts(root: bytes, stream, start: int, chunker, file_size: int, leaf_count: int):
+    """
+    Upload the stream in parallel parts, checked against the stored tree.
+    Returns (None, manifest); the upload is recorded as a manifest of its
+    parts.
+    """
+    merkle_root_hex = root.hex()
+    stream.seek(start)
+    with merkle_store.open(merkle_root_hex) as tree:
+        segments = upload_multipart(stream, tree)
+
+    # The part subroots must fold back into the root being registered
+    if combine_subroots(bytes.fromhex(s["subroot"]) for s in segments) != root:
+        raise Exception(f"Multipart subroots do not combine to {merkle_root_hex}")
+
+    manifest = {
+        'merkle_root': merkle_root_hex,
+        'parent_root': None,
+        'chunking': chunker.spec(),
+        'file_size': file_size,
+        'chunks': leaf_count,
+        'segments': segments,
+    }
+    manifests.put(manifest)
+    print(f"[multipart] {merkle_root_hex}: uploaded {len(segments)} parts")
+    return None, manifest
+
+def extract_blob_id(blob_info) -> str:
     # Extract blob_id with multiple fallbacks
     blob_id = blob_info.get('blob_id') if isinstance(blob_info, dict) else ''
-    print(f"[debug] blob_id after extraction type: {type(blob_id)}, value: {blob_id}")
-    
+
     # Ensure blob_id is a string, not a dict or other type
     if isinstance(blob_id, dict):
         blob_id = blob_id.get('blobId') or blob_id.get('blob_id') or ''
     elif blob_id is None:
         blob_id = ''
-    
+
     # Force to string
     blob_id = str(blob_id)
-    
+
     # Final validation
     if not isinstance(blob_id, str):
         raise Exception(f"blob_id must be a string, got {type(blob_id)}: {blob_id}. blob_info: {blob_info}")
-    
+
     if not blob_id or blob_id == '':
         raise Exception(f"Failed to extract blob_id from Walrus upload response. blob_info: {blob_info}")
-    
-    print(f"[debug] Final blob_id: {blob_id} (type: {type(blob_id)})")
 
-    # 2. Merkle root
-    chunks = list(chunk_file(path))
-    root, tree = build_merkle(chunks)
+    return blob_id
+
+def finish_dataset(dataset_id: bytes, blob_info, root: bytes, leaf_count: int, file_size: int,
+                   chunker, deduplicated: bool = False, manifest=None, timings=None,
+                   content_hash: str | None = None):
     merkle_root_hex = root.hex()
+    merkle_store.link(dataset_id.hex(), merkle_root_hex)
+    # Training identifies a dataset by the SHA-256 of its content, which
+    # finds the stored root whatever chunking it was ingested with
+    if content_hash:
+        merkle_store.link(content_hash, merkle_root_hex)
 
     # 3. zk-Proof
     # zk = Nautilus()
@@ -64,6 +441,10 @@ def process_dataset(path: str):
         'dataset_id': dataset_id.hex(),
         'blob_info': blob_info,
         'merkle_root': merkle_root_hex,
-        'chunks': len(chunks),
+        'chunks': leaf_count,
         'file_size': file_size,
+        'chunking': chunker.spec(),
+        'manifest': manifest,
+        'deduplicated': deduplicated,
+        'timings': timings,
     }
@@ -1,15 +1,33 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-import tempfile
-from .run_pipeline import process_dataset
-from .walrus_upload import download_dataset_walrus
-from pydantic import BaseModel
-from typing import Optional
+from .run_pipeline import process_stream, process_version
+from .walrus_upload import stream_blob
+from . import async_io
+from .blob_cache import blob_cache
+from .verified_stream import StreamVerifier, IntegrityError, verified
+from .blob_index import blob_index
+from .dataset_hash import dataset_hashes, hash_stream
+from .history_store import TrainingHistory
+from .lineage import lineage
+from .enclave_results import EnclaveResultCache
+from .jobs import job_queue, QueueFull
+from . import enclave_stream
+from .config import HISTORY_DB, JOB_SPOOL_DIR, VERIFY_BATCH_MAX_ITEMS, VERIFY_BATCH_HASH_WORKERS, PROOF_MAX_CHUNK_SIZE
+from .merkle import CHUNK_SIZE, rechunk, hash as hash_chunk, get_proof
+from .merkle_store import store as merkle_store
+from .chunking import FixedChunker, FastCDC
+from .manifest import manifests, read_manifest
+from pydantic import BaseModel, Field
+from typing import List, Optional
+import asyncio
 import hashlib
-import requests
-import os
 import json
+import os
+import tempfile
+import uuid
 from datetime import datetime
 from pathlib import Path
 import traceback
@@ -33,97 +51,232 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "Content-Range", "Accept-Ranges"],
 )
 
-@app.post("/upload-dataset")
-async def upload_dataset(file: UploadFile = File(...)):
-    # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(await file.read())
-        temp_path = tmp.name
+@app.on_event("startup")
+async def start_jobs():
+    await job_queue.start()
 
-    print("Processing dataset:", temp_path)
+@app.on_event("shutdown")
+async def close_http_pool():
+    await job_queue.stop()
+    await async_io.close()
 
-    try:
-        result = process_dataset(temp_path)
+def ingest_dataset(stream, filename: str, parent_root: Optional[str] = None,
+                   chunking: str = "fixed", multipart: bool = False,
+                   content_hash: Optional[str] = None) -> dict:
+    """
+    Run the ingest pipeline on a stream and build the /upload-dataset
+    response (blocking; call from the threadpool). `content_hash`, the
+    SHA-256 of the stream if already known, saves a pass over the data.
+    """
+    if parent_root:
+        # New version of an existing dataset: upload only changed chunks
+        result = process_version(stream, parent_root, content_hash)
         print("Result is: ", result)
+        blob_info = result["blob_info"] or {}
         return {
             "success": True,
-            # "tx": result["tx_digest"],
             "dataset_id": result["dataset_id"],
-            "blob_id": result["blob_info"]["blob_id"],
-            "blob_object_id": result["blob_info"]["blob_object_id"],
             "merkle_root": result["merkle_root"],
+            "parent_root": result["parent_root"],
+            "blob_id": blob_info.get("blob_id"),
             "chunks": result["chunks"],
             "file_size": result["file_size"],
-            "storage": result["blob_info"]["storage"],
-            "registered_epoch": result["blob_info"]["registered_epoch"],
-            "encoding_type": result["blob_info"]["encoding_type"],
-            "cost": result["blob_info"]["cost"],
-            "encoded_length": result["blob_info"]["encoded_length"],
-            "filename": file.filename
+            "reused_chunks": result["reused_chunks"],
+            "uploaded_chunks": result["uploaded_chunks"],
+            "uploaded_bytes": result["uploaded_bytes"],
+            "chunking": result["chunking"],
+            "filename": filename,
+            "deduplicated": result["deduplicated"],
+            "timings": result["timings"]
         }
 
+    if chunking not in ("fixed", "cdc"):
+        raise ValueError("chunking must be 'fixed' or 'cdc'")
+    chunker = FastCDC() if chunking == "cdc" else FixedChunker()
+
+    # Stream the upload straight through hashing and the Walrus upload
+    # instead of copying it into another temp file first.
+    result = process_stream(stream, chunker, multipart, content_hash)
+    print("Result is: ", result)
+    # Multipart uploads are stored as a manifest of part blobs
+    blob_info = result["blob_info"] or {}
+    manifest = result["manifest"]
+    return {
+        "success": True,
+        # "tx": result["tx_digest"],
+        "dataset_id": result["dataset_id"],
+        "blob_id": blob_info.get("blob_id"),
+        "blob_object_id": blob_info.get("blob_object_id"),
+        "merkle_root": result["merkle_root"],
+        "chunks": result["chunks"],
+        "file_size": result["file_size"],
+        "storage": blob_info.get("storage"),
+        "registered_epoch": blob_info.get("registered_epoch"),
+        "encoding_type": blob_info.get("encoding_type"),
+        "cost": blob_info.get("cost"),
+        "encoded_length": blob_info.get("encoded_length"),
+        "parts": len(manifest["segments"]) if manifest else None,
+        "chunking": result["chunking"],
+        "filename": filename,
+        "deduplicated": result["deduplicated"],
+        "timings": result["timings"]
+    }
+
+@job_queue.handler("ingest")
+async def run_ingest_job(params: dict, report) -> dict:
+    # The upload was spooled to disk when the job was submitted
+    try:
+        with open(params["path"], "rb") as f:
+            report("ingesting")
+            return await run_in_threadpool(ingest_dataset, f, params["filename"], params["parent_root"],
+                                           params["chunking"], params["multipart"],
+                                           params.get("content_hash"))
+    finally:
+        if os.path.exists(params["path"]):
+            os.remove(params["path"])
+
+def submit_job(kind: str, params: dict, priority: int) -> dict:
+    try:
+        job = job_queue.submit(kind, params, priority)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    print(f"Queued {kind} job {job['id']}")
+    return {"success": True, "jobId": job["id"], "status": job["status"]}
+
+@app.post("/upload-dataset")
+async def upload_dataset(
+    file: UploadFile = File(...),
+    parent_root: Optional[str] = Form(None),
+    chunking: str = Form("fixed"),
+    multipart: bool = Form(False),
+    background: bool = Form(False),
+    priority: int = Form(100)
+):
+    print("Processing dataset:", file.filename)
+
+    try:
+        if background:
+            # Keep the upload on disk so the job survives a restart
+            Path(JOB_SPOOL_DIR).mkdir(parents=True, exist_ok=True)
+            path = os.path.join(JOB_SPOOL_DIR, uuid.uuid4().hex)
+
+            def spool():
+                # Hash while copying so the job does not read the data again for its dedup key
+                digest = hashlib.sha256()
+                with open(path, "wb") as f:
+                    while chunk := file.file.read(1024 * 1024):
+                        digest.update(chunk)
+                        f.write(chunk)
+                return digest.hexdigest()
+
+            content_hash = await run_in_threadpool(spool)
+            return submit_job("ingest", {
+                "path": path,
+                "content_hash": content_hash,
+                "filename": file.filename,
+                "parent_root": parent_root,
+                "chunking": chunking,
+                "multipart": multipart,
+            }, priority)
+
+        # Hashing and the upload block, so keep them off the event loop
+        async with async_io.ingest_slots:
+            return await run_in_threadpool(ingest_dataset, file.file, file.filename, parent_root,
+                                           chunking, multipart)
+
+    except HTTPException:
+        raise
     except Exception as e:
         return {"success": False, "error": str(e)}
 
     finally:
-        os.remove(temp_path)
+        await file.close()
 
 @app.get("/download-dataset")
-async def download_dataset(blob_id: str):
+async def download_dataset(
+    blob_id: str,
+    verify: bool = False,
+    merkle_root: Optional[str] = None,
+    range: Optional[str] = Header(None)
+):
     print("blobId from python server is: ", blob_id)
-    # file_name = f"{uuid.uuid4()}.bin"
-    # destination_path = os.path.join("/tmp", file_name)
 
     try:
-        res = download_dataset_walrus(blob_id)
-        print("res is ", res)
-        return res
-
+        registered_root = blob_index.root_for_blob(blob_id)
+        expected_root = registered_root
+        if merkle_root:
+            expected_root = merkle_store.resolve(merkle_root) or merkle_root.lower().removeprefix("0x")
+
+        # Served from the local cache when the blob's Merkle root is known
+        # (the cache only holds blobs verified against that root), otherwise
+        # streamed straight from the aggregator with Range passed through
+        if not verify or expected_root == registered_root:
+            cached = await blob_cache.response(blob_id, range)
+            if cached is not None:
+                return cached
+
+        verifier = None
+        if verify:
+            # Per-chunk checks with the stored tree, else the root at EOF
+            try:
+                root = bytes.fromhex(expected_root or "")
+            except ValueError:
+                root = b""
+            if len(root) != 32:
+                raise HTTPException(status_code=400, detail="No valid Merkle root for this blob; pass merkle_root")
+            tree = merkle_store.open(expected_root)
+            verifier = StreamVerifier(root, tree)
+        return await async_io.download_dataset_walrus(blob_id, range, verifier)
+
+    except HTTPException:
+        raise
+    except IntegrityError as e:
+        print(f"Integrity check failed: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         print("Error {}", e)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/download-dataset-version")
+async def download_dataset_version(merkle_root: str, verify: bool = False):
+    """
+    Reassemble a dataset version from its chunk manifest
+    """
+    manifest = manifests.get(merkle_store.resolve(merkle_root) or "")
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="No manifest for this dataset version")
+
+    body = read_manifest(manifest)
+    if verify:
+        tree = merkle_store.open(manifest["merkle_root"])
+        body = verified(body, StreamVerifier(bytes.fromhex(manifest["merkle_root"]), tree))
+
+    return StreamingResponse(
+        body,
+        media_type="application/octet-stream",
+        headers={
+            "Content-Length": str(manifest["file_size"]),
+            "Content-Disposition": f'attachment; filename="{manifest["merkle_root"]}"',
+        },
+    )
+
 
 # Configuration
 ENCLAVE_URL = "http://16.170.234.164:3000/process_data"
 UPLOAD_FOLDER = './uploads'
-HISTORY_FILE = './training_history.json'
+HISTORY_FILE = './training_history.json'  # imported once into HISTORY_DB
 ALLOWED_EXTENSIONS = {'csv', 'json', 'txt', 'parquet'}
 
 # Ensure upload folder exists
 Path(UPLOAD_FOLDER).mkdir(parents=True, exist_ok=True)
 
-# In-memory storage
-training_history = {}  # request_hash -> training_record
-dataset_cache = {}     # dataset_path -> file_content/hash
-
-# Load training history from file on startup
-def load_training_history():
-    global training_history
-    try:
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, 'r') as f:
-                training_history = json.load(f)
-            print(f"Loaded {len(training_history)} training records from disk")
-    except Exception as e:
-        print(f"Error loading training history: {e}")
-        training_history = {}
-
-# Save training history to file
-def save_training_history():
-    try:
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(training_history, f, indent=2)
-        print(f"Saved {len(training_history)} training records to disk")
-    except Exception as e:
-        print(f"Error saving training history: {e}")
-
-# Load history on startup
-load_training_history()
+# Training records, one row each; request_hash -> training_record
+training_history = TrainingHistory(HISTORY_DB, legacy_json=HISTORY_FILE)
+enclave_results = EnclaveResultCache(training_history, ENCLAVE_URL)
 
 # Pydantic models
 class VerifyRequest(BaseModel):
@@ -136,6 +289,17 @@ class TrainingResponse(BaseModel):
     signature: str
     datasetSource: str
     timestamp: str
+    cached: bool = False
+
+class VerifyBatchItem(BaseModel):
+    requestHash: str
+    datasetPath: str
+
+class VerifyBatchRequest(BaseModel):
+    items: List[VerifyBatchItem]
+
+class EnclaveRegistration(BaseModel):
+    measurement: str
 
 class VerificationResponse(BaseModel):
     isValid: bool
@@ -143,88 +307,190 @@ class VerificationResponse(BaseModel):
     message: str
     details: Optional[dict] = None
 
+class ProofRequest(BaseModel):
+    indices: List[int]
+    merkle_root: Optional[str] = None
+    dataset_id: Optional[str] = None
+    blob_id: Optional[str] = None
+    chunk_size: int = Field(CHUNK_SIZE, gt=0, le=PROOF_MAX_CHUNK_SIZE)
+
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-async def upload_dataset_to_train(file: UploadFile) -> str:
+def upload_path(content_hash: str, filename: str) -> str:
+    # Uploads are named by content hash so re-submitting the same dataset
+    # reuses the file already on disk instead of writing another one
+    return os.path.join(UPLOAD_FOLDER, f"{content_hash}_{filename}")
+
+async def upload_dataset_to_train(file: UploadFile):
     """
-    Handle file upload and return the file path
+    Handle file upload and return (file path, merkle)
+    The upload is copied to disk chunk by chunk while its SHA-256 and
+    Merkle leaves are computed, so it is read once and never held in
+    memory; merkle is (root, leaves) as from compute_dataset_leaves
     """
     if not allowed_file(file.filename):
         raise ValueError(f"Invalid file type. Allowed: {ALLOWED_EXTENSIONS}")
 
-    # Add timestamp to avoid collisions
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{timestamp}_{file.filename}"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    def save():
+        with tempfile.NamedTemporaryFile(dir=UPLOAD_FOLDER, suffix=".part", delete=False) as f:
+            try:
+                content_hash, merkle = hash_stream(file.file, f)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+
+        filepath = upload_path(content_hash, file.filename)
+        if os.path.exists(filepath):
+            os.remove(f.name)
+        else:
+            os.replace(f.name, filepath)
+        dataset_hashes.remember(filepath, content_hash)
+        return filepath, merkle
 
-    # Save file
-    content = await file.read()
-    with open(filepath, 'wb') as f:
-        f.write(content)
+    return await run_in_threadpool(save)
 
-    return filepath
+async def hash_upload(file: UploadFile) -> str:
+    """
+    SHA-256 of an upload that is only being checked, not kept: it is
+    hashed as it is read and never written to disk
+    """
+    if not allowed_file(file.filename):
+        raise ValueError(f"Invalid file type. Allowed: {ALLOWED_EXTENSIONS}")
+    content_hash, _ = await run_in_threadpool(hash_stream, file.file)
+    return content_hash
+
+def compute_dataset_leaves(dataset_path: str):
+    """
+    (root, leaves) of a dataset file for streaming it to the enclave, or
+    None if the file cannot be read
+    """
+    try:
+        return enclave_stream.dataset_leaves(dataset_path)
+    except (OSError, ValueError):
+        return None
 
 def compute_dataset_hash(dataset_path: str) -> str:
     """
     Compute SHA256 hash of dataset content
     """
-    # Check if we already have this hash cached
-    if dataset_path in dataset_cache:
-        return dataset_cache[dataset_path]
-
     try:
-        # Read the file and compute hash
-        with open(dataset_path, 'rb') as f:
-            file_content = f.read()
-            dataset_hash = hashlib.sha256(file_content).hexdigest()
-            dataset_cache[dataset_path] = dataset_hash
-            return dataset_hash
+        # Streamed in fixed-size reads; unchanged files come from the cache
+        return dataset_hashes.compute(dataset_path)
     except FileNotFoundError:
         # If file doesn't exist, just hash the path string itself
         # This handles cases where frontend provides paths we can't access
-        dataset_hash = hashlib.sha256(dataset_path.encode()).hexdigest()
-        dataset_cache[dataset_path] = dataset_hash
-        return dataset_hash
+        return hashlib.sha256(dataset_path.encode()).hexdigest()
 
-def call_enclave(dataset_path: str) -> dict:
+async def call_enclave(dataset_path: str, merkle=None) -> dict:
     """
     Call the enclave with dataset and get trained model
+    The whole dataset is streamed in the binary framing of
+    enclave_stream.py, with `merkle` = (root, leaves) from
+    compute_dataset_leaves
     """
-    try:
-        # Read dataset content to send to enclave
-        with open(dataset_path, 'rb') as f:
-            dataset_content = f.read()
-            # Convert to format expected by enclave
-            # Using hex encoding as example, adjust based on your enclave's needs
-            input_data = dataset_content.hex()[:100]  # Truncate for demo
-    except FileNotFoundError:
+    if merkle is None:
         # If we can't read the file, use the path itself
-        input_data = dataset_path
+        payload = {
+            "payload": {
+                "input_data": dataset_path
+            }
+        }
+        return await async_io.post_enclave(ENCLAVE_URL, payload, timeout=30)
+
+    root, leaves = merkle
+    body = enclave_stream.frames(dataset_path, root, leaves)
+    return await async_io.post_enclave_stream(ENCLAVE_URL, body, enclave_stream.CONTENT_TYPE)
+
+async def run_training(dataset_path: str, dataset_source: str, report=print, merkle=None) -> dict:
+    """
+    Hash the dataset, train in the enclave and record the result
+    A dataset already trained by the registered enclave gets its stored
+    signed record back without another enclave call; `merkle` is the
+    dataset's (root, leaves) when already known
+    """
+    # Compute hash of the dataset for verification
+    report("Computing dataset hash...")
+    dataset_hash = await run_in_threadpool(compute_dataset_hash, dataset_path)
+    print(f"Dataset hash: {dataset_hash}")
+
+    async def train() -> dict:
+        # The Merkle leaves go to the enclave with the data, and the root links
+        # the model into the dataset's version lineage
+        nonlocal merkle
+        if merkle is None:
+            merkle = await run_in_threadpool(compute_dataset_leaves, dataset_path)
+        dataset_root = merkle[0].hex() if merkle else None
+
+        # Call enclave to train model
+        report("Calling enclave...")
+        enclave_response = await call_enclave(dataset_path, merkle)
+        print(f"Enclave response: {enclave_response}")
+
+        # Extract response data
+        response_data = enclave_response.get('response', {}).get('data', {})
+        request_hash = response_data.get('request_hash')
+        updated_weights = response_data.get('updated_weights', [])
+        signature = enclave_response.get('signature')
+        timestamp = enclave_response.get('response', {}).get('timestamp_ms')
+
+        print(f"Request hash: {request_hash}")
 
-    payload = {
-        "payload": {
-            "input_data": input_data
+        # Store in training history
+        training_record = {
+            'request_hash': request_hash,
+            'dataset_path': dataset_path,
+            'dataset_source': dataset_source,
+            'dataset_hash': dataset_hash,
+            'model_weights': updated_weights,
+            'signature': signature,
+            'timestamp': timestamp,
+            'timestamp_iso': datetime.fromtimestamp(timestamp/1000).isoformat() if timestamp else datetime.now().isoformat()
         }
-    }
 
-    headers = {'Content-Type': 'application/json'}
+        # Link the model to its dataset (by Merkle root when we have the file)
+        training_record['dataset_merkle_root'] = dataset_root
 
-    try:
-        response = requests.post(ENCLAVE_URL, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Enclave call failed: {str(e)}")
+        # Persisted as a single indexed insert
+        await run_in_threadpool(training_history.put, training_record)
+        # Lineage uses the root the dataset was ingested under; with
+        # content-defined chunking it differs from the fixed-size root above
+        lineage_root = await run_in_threadpool(merkle_store.resolve, dataset_hash)
+        await run_in_threadpool(lineage.add_training, lineage_root or dataset_root or dataset_hash, request_hash)
+        print(f"Training record stored: {request_hash}")
+        return training_record
+
+    training_record, cached = await enclave_results.get_or_train(dataset_hash, train)
+    request_hash = training_record['request_hash']
+    if cached:
+        print(f"Reusing training record: {request_hash}")
+
+    # Return response to frontend
+    return {
+        'requestHash': request_hash,
+        'modelWeights': f"llm-trained-v_{request_hash[:16]}.pt",
+        'signature': training_record['signature'],
+        'datasetSource': dataset_source,
+        'timestamp': training_record['timestamp_iso'],
+        'cached': cached
+    }
+
+@job_queue.handler("train")
+async def run_training_job(params: dict, report) -> dict:
+    return await run_training(params["dataset_path"], params["dataset_source"], report)
 
 @app.post("/api/train")
 async def train_model(
     dataset: Optional[UploadFile] = File(None),
-    datasetPath: Optional[str] = Form(None)
+    datasetPath: Optional[str] = Form(None),
+    background: bool = Form(False),
+    priority: int = Form(100)
 ):
     """
     Handle training request from frontend
     Accepts either file upload or file path
+    With background, returns a job id to poll at /api/jobs/{id}
     """
     print("Training request received")
     print(f"Dataset file: {dataset.filename if dataset else 'None'}")
@@ -233,12 +499,13 @@ async def train_model(
     try:
         dataset_path = None
         dataset_source = None
+        merkle = None
 
         # Check if file was uploaded
         if dataset and dataset.filename:
             print(f"Processing uploaded file: {dataset.filename}")
             # Upload the file and get path
-            dataset_path = await upload_dataset_to_train(dataset)
+            dataset_path, merkle = await upload_dataset_to_train(dataset)
             dataset_source = dataset.filename
             print(f"File saved to: {dataset_path}")
 
@@ -251,52 +518,13 @@ async def train_model(
         else:
             raise HTTPException(status_code=400, detail="No dataset provided")
 
-        # Compute hash of the dataset for verification
-        print("Computing dataset hash...")
-        dataset_hash = compute_dataset_hash(dataset_path)
-        print(f"Dataset hash: {dataset_hash}")
-
-        # Call enclave to train model
-        print("Calling enclave...")
-        enclave_response = call_enclave(dataset_path)
-        print(f"Enclave response: {enclave_response}")
-
-        # Extract response data
-        response_data = enclave_response.get('response', {}).get('data', {})
-        request_hash = response_data.get('request_hash')
-        updated_weights = response_data.get('updated_weights', [])
-        signature = enclave_response.get('signature')
-        timestamp = enclave_response.get('response', {}).get('timestamp_ms')
-
-        print(f"Request hash: {request_hash}")
-
-        # Store in training history
-        training_record = {
-            'request_hash': request_hash,
-            'dataset_path': dataset_path,
-            'dataset_source': dataset_source,
-            'dataset_hash': dataset_hash,
-            'model_weights': updated_weights,
-            'signature': signature,
-            'timestamp': timestamp,
-            'timestamp_iso': datetime.fromtimestamp(timestamp/1000).isoformat() if timestamp else datetime.now().isoformat()
-        }
-
-        training_history[request_hash] = training_record
-        print(f"Training record stored. Total records: {len(training_history)}")
+        if background:
+            return submit_job("train", {"dataset_path": dataset_path, "dataset_source": dataset_source}, priority)
 
-        # Persist to disk
-        save_training_history()
-
-        # Return response to frontend
-        return {
-            'requestHash': request_hash,
-            'modelWeights': f"llm-trained-v_{request_hash[:16]}.pt",
-            'signature': signature,
-            'datasetSource': dataset_source,
-            'timestamp': training_record['timestamp_iso']
-        }
+        return await run_training(dataset_path, dataset_source, merkle=merkle)
 
+    except HTTPException:
+        raise
     except ValueError as e:
         print(f"Validation error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -305,6 +533,63 @@ async def train_model(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
 
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of a background ingest or training job; result is set once
+    status is "done", error once it is "failed"
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-sent events with the job's state on every change, ending when
+    the job finishes
+    """
+    if job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for job in job_queue.watch(job_id):
+            yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+def verification_result(request_hash: str, training_record: dict, dataset_path: str,
+                        provided_dataset_hash: str, provided_dataset: str) -> dict:
+    """
+    Compare a dataset's hash with the dataset recorded for a model
+    """
+    # Compare hashes
+    is_valid = provided_dataset_hash == training_record['dataset_hash']
+
+    # Also check if the paths match (for user-friendly verification)
+    path_matches = dataset_path == training_record['dataset_path']
+
+    if is_valid:
+        message = 'Dataset verified! This model was trained using the specified dataset.'
+    elif path_matches:
+        message = 'Dataset path matches, but content hash differs. Dataset may have been modified.'
+    else:
+        message = 'Verification failed. The dataset does not match the training record.'
+
+    return {
+        'isValid': is_valid,
+        'requestHash': request_hash,
+        'message': message,
+        'details': {
+            'expected_dataset': training_record['dataset_source'],
+            'provided_dataset': provided_dataset,
+            'hash_match': is_valid,
+            'path_match': path_matches
+        }
+    }
+
 @app.post("/api/verify")
 async def verify_model(
     requestHash: str = Form(...),
@@ -318,12 +603,15 @@ async def verify_model(
     print(f"Verification request - Request Hash: {requestHash}")
 
     try:
+        provided_dataset_hash = None
+
         # Determine dataset path
         if dataset and dataset.filename:
             print(f"Processing uploaded file for verification: {dataset.filename}")
-            # Save uploaded file temporarily
-            dataset_path = await upload_dataset_to_train(dataset)
-            print(f"Verification file saved to: {dataset_path}")
+            # Hashed as it is received and not kept; compared as if it had
+            # been saved by /api/train
+            provided_dataset_hash = await hash_upload(dataset)
+            dataset_path = upload_path(provided_dataset_hash, dataset.filename)
         elif datasetPath:
             print(f"Using provided path for verification: {datasetPath}")
             dataset_path = datasetPath
@@ -331,7 +619,8 @@ async def verify_model(
             raise HTTPException(status_code=400, detail="No dataset provided")
 
         # Check if we have this training record
-        if requestHash not in training_history:
+        training_record = await run_in_threadpool(training_history.get, requestHash)
+        if training_record is None:
             print(f"No training record found for hash: {requestHash}")
             return {
                 'isValid': False,
@@ -339,58 +628,117 @@ async def verify_model(
                 'message': "No training record found for this model"
             }
 
-        # Get the training record
-        training_record = training_history[requestHash]
         print(f"Found training record: {training_record['dataset_source']}")
 
         # Compute hash of provided dataset
-        print("Computing hash of provided dataset...")
-        provided_dataset_hash = compute_dataset_hash(dataset_path)
+        if provided_dataset_hash is None:
+            print("Computing hash of provided dataset...")
+            provided_dataset_hash = await run_in_threadpool(compute_dataset_hash, dataset_path)
         print(f"Provided hash: {provided_dataset_hash}")
         print(f"Expected hash: {training_record['dataset_hash']}")
 
-        # Compare hashes
-        is_valid = provided_dataset_hash == training_record['dataset_hash']
-
-        # Also check if the paths match (for user-friendly verification)
-        path_matches = dataset_path == training_record['dataset_path']
-
-        if is_valid:
-            message = 'Dataset verified! This model was trained using the specified dataset.'
-        elif path_matches:
-            message = 'Dataset path matches, but content hash differs. Dataset may have been modified.'
-        else:
-            message = 'Verification failed. The dataset does not match the training record.'
-
-        print(f"Verification result: {is_valid}")
-
-        return {
-            'isValid': is_valid,
-            'requestHash': requestHash,
-            'message': message,
-            'details': {
-                'expected_dataset': training_record['dataset_source'],
-                'provided_dataset': dataset.filename if dataset else dataset_path,
-                'hash_match': is_valid,
-                'path_match': path_matches
-            }
-        }
+        result = verification_result(requestHash, training_record, dataset_path, provided_dataset_hash,
+                                     dataset.filename if dataset else dataset_path)
+        print(f"Verification result: {result['isValid']}")
+        return result
 
     except Exception as e:
         print(f"Error during verification: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Verification failed: {str(e)}")
 
+@app.post("/api/verify/batch")
+async def verify_batch(batch: VerifyBatchRequest):
+    """
+    Verify many (requestHash, datasetPath) pairs in one request
+    Each distinct dataset is hashed once, VERIFY_BATCH_HASH_WORKERS at a
+    time, and results stream back as NDJSON in completion order: one line
+    per item (with its index in the request, and the /api/verify result
+    or an error), then a summary line
+    """
+    items = batch.items
+    if len(items) > VERIFY_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {VERIFY_BATCH_MAX_ITEMS} items per batch")
+
+    def dataset_key(path: str) -> str:
+        # Different spellings of the same file share one hash
+        return os.path.realpath(path) if os.path.exists(path) else path
+
+    def plan():
+        records = {h: training_history.get(h) for h in {item.requestHash for item in items}}
+        return records, [dataset_key(item.datasetPath) for item in items]
+
+    def line(obj) -> bytes:
+        return (json.dumps(obj) + "\n").encode()
+
+    async def results():
+        records, keys = await run_in_threadpool(plan)
+        valid = errors = 0
+        by_dataset = {}
+        for index, item in enumerate(items):
+            if records[item.requestHash] is None:
+                yield line({'index': index, 'isValid': False, 'requestHash': item.requestHash,
+                            'message': "No training record found for this model"})
+            else:
+                by_dataset.setdefault(keys[index], []).append(index)
+
+        slots = asyncio.Semaphore(VERIFY_BATCH_HASH_WORKERS)
+
+        async def hash_dataset(key, indices):
+            async with slots:
+                try:
+                    return indices, await run_in_threadpool(compute_dataset_hash, items[indices[0]].datasetPath), None
+                except Exception as e:
+                    return indices, None, e
+
+        tasks = [asyncio.ensure_future(hash_dataset(key, indices)) for key, indices in by_dataset.items()]
+        try:
+            for done in asyncio.as_completed(tasks):
+                indices, provided_hash, error = await done
+                for index in indices:
+                    item = items[index]
+                    if error is not None:
+                        errors += 1
+                        yield line({'index': index, 'requestHash': item.requestHash, 'error': str(error)})
+                        continue
+                    result = verification_result(item.requestHash, records[item.requestHash], item.datasetPath,
+                                                 provided_hash, item.datasetPath)
+                    valid += result['isValid']
+                    yield line({'index': index, **result})
+        finally:
+            # The client went away: stop hashing what nobody will read
+            for task in tasks:
+                task.cancel()
+
+        yield line({'summary': {'items': len(items), 'datasets': len(by_dataset), 'valid': valid,
+                                'errors': errors}})
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.get("/api/training-history")
-async def get_training_history():
+async def get_training_history(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    datasetHash: Optional[str] = None,
+    datasetSource: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None
+):
     """
-    Get all training history records
+    Get training history records, newest first, one page at a time.
+    Pass nextCursor back as cursor for the following page; since/until
+    are epoch milliseconds.
     """
-    print(f"Fetching training history. Total records: {len(training_history)}")
+    print(f"Fetching training history page (cursor={cursor})")
 
     try:
+        # Read in index order; no sorting or full scan per request
+        records, next_cursor = await run_in_threadpool(
+            training_history.page, limit, cursor, datasetHash, datasetSource, since, until)
+
         history = []
-        for request_hash, record in training_history.items():
+        for record in records:
+            request_hash = record['request_hash']
             history.append({
                 'requestHash': request_hash,
                 'datasetSource': record['dataset_source'],
@@ -399,16 +747,139 @@ async def get_training_history():
                 'timestamp': record['timestamp_iso']
             })
 
-        # Sort by timestamp, newest first
-        history.sort(key=lambda x: x['timestamp'], reverse=True)
-
-        return {'history': history}
+        return {'history': history, 'nextCursor': next_cursor}
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error fetching history: {e}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to fetch history: {str(e)}")
 
+def lineage_key(dataset: str) -> str:
+    # Accept a dataset id, Merkle root or flat dataset hash
+    return merkle_store.resolve(dataset) or dataset.lower().removeprefix("0x")
+
+@app.get("/api/lineage/dataset/{dataset}/models")
+async def get_dataset_models(dataset: str, transitive: bool = True):
+    """
+    Models trained on a dataset and, with transitive, on any version
+    derived from it
+    """
+    root = lineage_key(dataset)
+    models = await run_in_threadpool(lineage.models_for_dataset, root, transitive)
+    return {'dataset': root, 'transitive': transitive, 'models': models}
+
+@app.get("/api/lineage/model/{request_hash}")
+async def get_model_lineage(request_hash: str):
+    """
+    Datasets a model was trained on, followed by their ancestor versions
+    """
+    datasets = await run_in_threadpool(lineage.datasets_for_model, request_hash)
+    if not datasets:
+        raise HTTPException(status_code=404, detail="No lineage recorded for this model")
+    return {'requestHash': request_hash, 'datasets': datasets}
+
+@app.get("/api/lineage/dataset/{dataset}")
+async def get_dataset_lineage(dataset: str, depth: Optional[int] = None):
+    """
+    Lineage subgraph around a dataset: ancestor versions above it and
+    derived versions and trained models below it, as edge lists
+    """
+    node = f"dataset:{lineage_key(dataset)}"
+    ancestors = await run_in_threadpool(lineage.walk, node, "up", None, depth)
+    descendants = await run_in_threadpool(lineage.walk, node, "down", None, depth)
+
+    def edge(e):
+        return {'from': e[0], 'to': e[1], 'kind': e[2]}
+
+    return {
+        'dataset': node,
+        'ancestors': [edge(e) for e in ancestors],
+        'descendants': [edge(e) for e in descendants],
+    }
+
+@app.post("/api/proofs")
+async def get_chunk_proofs(request: ProofRequest):
+    """
+    Merkle inclusion proofs for a list of chunk indices of a stored dataset,
+    so auditors can spot-check chunks instead of re-hashing everything.
+    Trees are looked up by merkle_root or dataset_id; if only blob_id is
+    known the tree is rebuilt from Walrus once and linked to the blob id
+    and chunk size for next time.
+    """
+    key = request.merkle_root or request.dataset_id
+    print(f"Proof request for {key or request.blob_id}: {len(request.indices)} indices")
+    if not key and request.blob_id:
+        key = merkle_store.blob_key(request.blob_id, request.chunk_size)
+
+    def rebuild_tree():
+        with merkle_store.writer(FixedChunker(request.chunk_size)) as tree_writer:
+            for chunk in rechunk(stream_blob(request.blob_id), request.chunk_size):
+                tree_writer.add_leaf(hash_chunk(chunk), len(chunk))
+            root = tree_writer.finalize()
+        merkle_store.link(merkle_store.blob_key(request.blob_id, request.chunk_size), root.hex())
+        return merkle_store.open(root.hex())
+
+    try:
+        tree = merkle_store.open(key) if key else None
+        if tree is None:
+            if not request.blob_id:
+                raise HTTPException(status_code=404, detail="No stored Merkle tree for this dataset")
+            tree = await run_in_threadpool(rebuild_tree)
+
+        with tree:
+            try:
+                proofs = [
+                    {
+                        'index': index,
+                        'leaf': tree.levels[0][index].hex(),
+                        'proof': [p.hex() for p in get_proof(tree.levels, index)],
+                    }
+                    for index in request.indices
+                ]
+            except IndexError as e:
+                raise HTTPException(status_code=400, detail=f"Chunk index out of range: {e}")
+
+            return {
+                'merkle_root': tree.root.hex(),
+                'chunks': tree.leaf_count,
+                'chunk_size': tree.chunk_size,
+                'chunking': tree.chunker.spec(),
+                'proofs': proofs,
+            }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error generating proofs: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Proof generation failed: {str(e)}")
+
+@app.get("/api/blob-cache")
+async def blob_cache_stats():
+    """
+    Hit/miss/eviction counters and size of the local blob cache
+    """
+    return blob_cache.stats()
+
+@app.post("/api/enclave/register")
+async def register_enclave(registration: EnclaveRegistration):
+    """
+    Record that a new enclave (or a new build of it) has been registered
+    on chain. Memoized training results were signed by the previous
+    enclave, so they are all dropped.
+    """
+    dropped = await run_in_threadpool(enclave_results.register, registration.measurement)
+    return {'success': True, 'measurement': registration.measurement, 'droppedResults': dropped}
+
+@app.get("/api/enclave/results")
+async def enclave_result_stats():
+    """
+    Registered enclave and hit/miss counters of the training result cache
+    """
+    return await run_in_threadpool(enclave_results.stats)
+
 @app.get("/api/health")
 @app.post("/api/health")
 async def health_check():
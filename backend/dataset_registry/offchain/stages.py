@@ -0,0 +1,159 @@
+"""
+Concurrent ingest stages connected by bounded queues.
+
+Reading, Merkle hashing and the Walrus upload each run as a Stage. A stage
+started with start() runs on its own thread and takes its input from a
+bounded queue (put()/close() on the producing side, items() on the
+consuming side), so a slow stage holds up the ones feeding it instead of
+letting chunks pile up in memory. File reads and hashlib both release the
+GIL, so reading and hashing really do overlap. run() runs a stage in the
+calling thread, timed the same way. Stored content is recognised by its
+SHA-256 before these stages start, so new content is uploaded while it is
+still being hashed.
+
+Every stage records where its time went, and timings() reports them per
+stage (bytes and items are counted on input):
+
+- seconds: wall-clock time from start to finish
+- idle: time spent waiting for input
+- backpressure: time producers spent blocked because this stage's queue
+  was full, i.e. how much this stage was the bottleneck
+"""
+import queue
+import threading
+import time
+
+from .config import PIPELINE_QUEUE_DEPTH
+
+_END = object()
+
+
+class StageCancelled(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, name: str, depth: int = PIPELINE_QUEUE_DEPTH):
+        self.name = name
+        self.queue = queue.Queue(depth)
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.thread = None
+        self.result = None
+        self.error = None
+        self.seconds = self.idle = self.backpressure = 0.0
+        self.items_in = self.bytes_in = 0
+
+    def _call(self, fn, args):
+        started = time.perf_counter()
+        try:
+            self.result = fn(*args)
+        except StageCancelled:
+            self.result = None
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.seconds = time.perf_counter() - started
+            self.done.set()
+
+    def run(self, fn, *args):
+        # Run in the calling thread; returns fn's result or raises its error
+        self._call(fn, args)
+        return self.join()
+
+    def start(self, fn, *args):
+        self.thread = threading.Thread(target=self._call, args=(fn, args), name=f"stage-{self.name}", daemon=True)
+        self.thread.start()
+        return self
+
+    def put(self, item):
+        """
+        Hand the stage its next input, blocking while its queue is full.
+        Re-raises the stage's error if it has failed; input for a stage that
+        has already finished is dropped.
+        """
+        started = time.perf_counter()
+        while not self.done.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.backpressure += time.perf_counter() - started
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        # No more input
+        self.put(_END)
+
+    def items(self):
+        # The stage's input, for use inside the stage
+        while True:
+            started = time.perf_counter()
+            item = self.queue.get()
+            self.idle += time.perf_counter() - started
+            if self.cancelled.is_set():
+                raise StageCancelled()
+            if item is _END:
+                return
+            yield self._count(item)
+
+    def watch(self, iterable):
+        # Like items() for input that does not come through the queue
+        it = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            item = next(it, _END)
+            self.idle += time.perf_counter() - started
+            if self.cancelled.is_set():
+                raise StageCancelled()
+            if item is _END:
+                return
+            yield self._count(item)
+
+    def _count(self, item):
+        self.items_in += 1
+        self.bytes_in += len(item)
+        return item
+
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def cancel(self):
+        """
+        Stop the stage at its next input and wait for it, discarding
+        whatever it returned or raised.
+        """
+        self.cancelled.set()
+        try:
+            self.queue.put_nowait(_END)  # wake it if it is waiting for input
+        except queue.Full:
+            pass
+        if self.thread is not None:
+            self.thread.join()
+        self.result = self.error = None
+
+    def timings(self) -> dict:
+        return {
+            "seconds": round(self.seconds, 3),
+            "idle": round(self.idle, 3),
+            "backpressure": round(self.backpressure, 3),
+            "items": self.items_in,
+            "bytes": self.bytes_in,
+            "cancelled": self.cancelled.is_set(),
+        }
+
+
+def stage_timings(started: float, *stages) -> dict:
+    """
+    Per-stage timings plus total wall-clock seconds since `started`
+    (a time.perf_counter() value). Stages that never ran are left out.
+    """
+    report = {stage.name: stage.timings() for stage in stages if stage.done.is_set()}
+    report["total_seconds"] = round(time.perf_counter() - started, 3)
+    return report
@@ -0,0 +1,105 @@
+"""
+Merkle verification of a dataset while it streams past.
+
+StreamVerifier re-cuts arbitrary pieces into the dataset's chunks, hashes
+each one into an incremental MerkleBuilder and only hands bytes on once
+they are verified:
+
+- with the stored tree, every chunk is checked against its leaf as soon as
+  it is complete, so a bad chunk stops the stream before it is sent;
+- with only the root, chunks are cut every chunk_size bytes and the last
+  one is held back until the root matches at EOF.
+
+Either way the data is hashed exactly once, on its way to the client.
+"""
+from .merkle import CHUNK_SIZE, MerkleBuilder, hash as hash_chunk
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class StreamVerifier:
+    def __init__(self, root: bytes, tree=None, chunk_size: int = CHUNK_SIZE):
+        self.root = root
+        self.tree = tree
+        self.chunk_size = tree.chunk_size if tree is not None else chunk_size
+        self.builder = MerkleBuilder()
+        self.buf = bytearray()
+        self.held = b""
+        self.index = 0
+
+    def _next_length(self) -> int:
+        if self.tree is None:
+            return self.chunk_size
+        if self.index >= self.tree.leaf_count:
+            raise IntegrityError(f"Data runs past the {self.tree.leaf_count} chunks of the dataset")
+        return self.tree.chunk_offset(self.index + 1) - self.tree.chunk_offset(self.index)
+
+    def _check(self, chunk) -> bytes:
+        leaf = hash_chunk(chunk)
+        if self.tree is not None and leaf != self.tree.levels[0][self.index]:
+            raise IntegrityError(f"Chunk {self.index} does not match the dataset's Merkle tree")
+        self.builder.update_leaf(leaf)
+        self.index += 1
+        return bytes(chunk)
+
+    def feed(self, piece: bytes) -> bytes:
+        """
+        Add the next piece of the stream; returns the bytes verified so far
+        that have not been returned yet (possibly empty).
+        """
+        self.buf += piece
+        out = [self.held]
+        self.held = b""
+        start = 0
+        with memoryview(self.buf) as view:
+            while start < len(view):
+                length = self._next_length()
+                if len(view) - start < length:
+                    break
+                out.append(self._check(view[start:start + length]))
+                start += length
+        del self.buf[:start]
+
+        # Without per-chunk leaves nothing is known good until the root matches
+        if self.tree is None and len(out) > 1:
+            self.held = out.pop()
+        return b"".join(out)
+
+    def finish(self) -> bytes:
+        """
+        End of stream: verify the last (short) chunk and the root, and
+        return whatever was still held back.
+        """
+        tail = b""
+        if self.buf:
+            self._next_length()
+            tail = self._check(self.buf)
+        try:
+            root = self.builder.finalize()
+        except ValueError:
+            raise IntegrityError("No data received")
+        if root != self.root:
+            raise IntegrityError(f"Data does not match Merkle root {self.root.hex()}")
+        held, self.held, self.buf = self.held, b"", bytearray()
+        return held + tail
+
+    def close(self):
+        # Releases the stored tree's mapping; call once the stream is done
+        if self.tree is not None:
+            self.tree.close()
+
+
+def verified(pieces, verifier: StreamVerifier):
+    # Sync generator: pass `pieces` through `verifier`, closing it at the end
+    try:
+        for piece in pieces:
+            out = verifier.feed(piece)
+            if out:
+                yield out
+        out = verifier.finish()
+        if out:
+            yield out
+    finally:
+        verifier.close()
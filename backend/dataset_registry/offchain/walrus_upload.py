@@ -1,21 +1,93 @@
 import requests
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 from walrus import WalrusClient
 import os
 import re
 import urllib.parse
 import mimetypes
+import random
+import threading
+import time
 import magic
 
+from .config import WALRUS_MAX_UPLOADS, WALRUS_UPLOAD_TIMEOUT
+
 publisher_url = "https://publisher.walrus-testnet.walrus.space"
 aggregator_url = "https://aggregator.walrus-testnet.walrus.space"
 client = WalrusClient(publisher_base_url=publisher_url, aggregator_base_url=aggregator_url) 
 
+# Shared by every blocking upload below, whichever thread it runs on
+upload_slots = threading.BoundedSemaphore(WALRUS_MAX_UPLOADS)
+
 
 def upload_to_walrus(path: str):
     blob_response = client.put_blob_from_file(path)
+    return parse_blob_response(blob_response)
+
+
+def upload_stream_to_walrus(chunks, timeout=WALRUS_UPLOAD_TIMEOUT):
+    # `chunks` is any iterable of bytes; requests sends it with chunked
+    # transfer encoding, so the body never has to exist in memory at once.
+    # The read timeout bounds each wait on the publisher, not the whole upload.
+    with upload_slots:
+        resp = requests.put(f"{publisher_url}/v1/blobs", data=chunks, timeout=timeout,
+                            headers={"Content-Type": "application/octet-stream"})
+    resp.raise_for_status()
+    return parse_blob_response(resp.json())
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def put_blob_with_retry(data: bytes, retries: int = 3, backoff: float = 1.0,
+                        publisher: str | None = None, timeout=WALRUS_UPLOAD_TIMEOUT):
+    """
+    Upload one in-memory blob, retrying connection errors, timeouts and
+    5xx/429 answers with exponential backoff and jitter. An upload slot is
+    held per attempt, not across the backoff.
+    """
+    url = f"{publisher or publisher_url}/v1/blobs"
+    for attempt in range(retries + 1):
+        try:
+            with upload_slots:
+                resp = requests.put(url, data=data, timeout=timeout,
+                                    headers={"Content-Type": "application/octet-stream"})
+            if resp.status_code not in RETRY_STATUSES:
+                resp.raise_for_status()
+                return parse_blob_response(resp.json())
+            error = Exception(f"publisher returned {resp.status_code}")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+
+        if attempt == retries:
+            raise Exception(f"Walrus upload failed after {retries + 1} attempts: {error}")
+        delay = backoff * (2 ** attempt) * (1 + random.random())
+        print(f"[walrus] upload attempt {attempt + 1} failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def parse_blob_response(blob_response):
     print("[walrus] raw response:", blob_response)
 
+    # Content the publisher already has comes back without a new blob object
+    if isinstance(blob_response, dict) and "alreadyCertified" in blob_response:
+        certified = blob_response["alreadyCertified"]
+        return {
+            "blob_id": str(certified.get("blobId", "")),
+            "blob_object_id": "",
+            "size": 0,
+            "registered_epoch": 0,
+            "encoding_type": "",
+            "storage": {
+                "id": "",
+                "start_epoch": 0,
+                "end_epoch": certified.get("endEpoch", 0),
+                "storage_size": 0,
+            },
+            "cost": 0,
+            "encoded_length": 0,
+        }
+
     # Validate top-level shape
     if not isinstance(blob_response, dict) or "newlyCreated" not in blob_response:
         raise Exception("Unexpected Walrus upload response format")
@@ -75,25 +147,51 @@ def upload_to_walrus(path: str):
         ),
     }
 
-    
-def download_dataset_walrus(blob_id: str, destination_path: str | None = None):
-    # Download blob from Walrus
-    print("from the method inside download_dataset_walrus")
+
+def stream_blob(blob_id: str, piece_size: int = 64 * 1024, start: int = 0, length: int | None = None):
+    # Yield the blob body (or the byte range [start, start + length)) from
+    # the aggregator without touching the disk.
     url = f"{aggregator_url}/v1/blobs/{blob_id}"
-    
-    resp = requests.get(url, stream=True)
+    headers = {}
+    if start or length is not None:
+        end = "" if length is None else start + length - 1
+        headers["Range"] = f"bytes={start}-{end}"
+
+    with requests.get(url, headers=headers, stream=True) as resp:
+        resp.raise_for_status()
+        # An aggregator that ignores Range answers 200 with the whole blob
+        skip = start if resp.status_code != 206 else 0
+        remaining = length
+        for piece in resp.iter_content(chunk_size=piece_size):
+            if skip:
+                dropped = min(skip, len(piece))
+                piece = piece[dropped:]
+                skip -= dropped
+            if remaining is not None:
+                piece = piece[:remaining]
+                remaining -= len(piece)
+            if piece:
+                yield piece
+            if remaining == 0:
+                break
+
+
+def blob_exists(blob_id: str, timeout: float = 30) -> bool:
+    # Whether the aggregator still serves a blob; expired or deleted blobs answer 404
+    resp = requests.head(f"{aggregator_url}/v1/blobs/{blob_id}", timeout=timeout)
+    if resp.status_code == 404:
+        return False
     resp.raise_for_status()
+    return True
 
-    # --- 1. Read first bytes to detect file type ---
-    # You need a short peek buffer to detect content type
-    first_chunk = next(resp.iter_content(chunk_size=2048))
 
-    mime_type = magic.from_buffer(first_chunk, mime=True)
+def guess_download_name(blob_id: str, first_chunk: bytes):
+    # Pick a MIME type and file extension from the first bytes of a blob
+    mime_type = magic.from_buffer(first_chunk, mime=True) if first_chunk else None
     print("mime type is ", mime_type)
     if mime_type is None:
         mime_type = "application/octet-stream"
 
-    # --- 2. Determine extension from mime type ---
     ext = mimetypes.guess_extension(mime_type) or ""
     print("ext type is ", ext)
 
@@ -101,19 +199,32 @@ def download_dataset_walrus(blob_id: str, destination_path: str | None = None):
     if ext == ".jpe":
         ext = ".jpg"
 
-    filename = f"{blob_id}{ext}"
+    return mime_type, f"{blob_id}{ext}"
+
+
+def download_dataset_walrus(blob_id: str):
+    # Stream a blob from Walrus straight to the client, without a local copy
+    print("from the method inside download_dataset_walrus")
+    url = f"{aggregator_url}/v1/blobs/{blob_id}"
+
+    resp = requests.get(url, stream=True)
+    resp.raise_for_status()
+
+    # Peek at the first bytes to detect the file type, then send them on
+    pieces = resp.iter_content(chunk_size=64 * 1024)
+    first_chunk = next(pieces, b"")
+    mime_type, filename = guess_download_name(blob_id, first_chunk)
     print("filename is ", filename)
 
-    # --- 3. Save the file to disk ---
-    with open(filename, "wb") as f:
-        f.write(first_chunk)  # write the initial chunk we peeked
-        for chunk in resp.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+    def body():
+        try:
+            yield first_chunk
+            yield from pieces
+        finally:
+            resp.close()
 
-    # --- 4. Return file with correct headers ---
-    return FileResponse(
-        filename,
+    return StreamingResponse(
+        body(),
         media_type=mime_type,
-        filename=filename
-    )
\ No newline at end of file
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
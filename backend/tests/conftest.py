@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Import the offchain modules the way the Dockerfile runs them (backend/ on the path)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The modules create their stores (merkle_store/, blob_index.json, ...) in the
+# working directory when imported; keep those out of the source tree
+os.chdir(tempfile.mkdtemp(prefix="chaintrain-tests-"))
@@ -0,0 +1,118 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from dataset_registry.offchain.chunking import FixedChunker
+from dataset_registry.offchain.merkle import combine_subroots, chunk_stream, hash as hash_chunk
+from dataset_registry.offchain.merkle_store import store as merkle_store
+from dataset_registry.offchain.multipart_upload import upload_multipart
+
+CHUNK_SIZE = 1024
+
+
+class Publisher(BaseHTTPRequestHandler):
+    """Walrus publisher stand-in: PUT /v1/blobs stores the body under its SHA-256."""
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            status = server.failures.pop(0) if server.failures else 200
+            if status == 200:
+                blob_id = hashlib.sha256(body).hexdigest()
+                server.blobs[blob_id] = body
+        if status != 200:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        reply = json.dumps({"newlyCreated": {"blobObject": {
+            "id": f"0x{blob_id[:8]}", "blobId": blob_id, "size": len(body), "registeredEpoch": 1,
+            "encodingType": "RS2", "storage": {"id": "0x1", "startEpoch": 1, "endEpoch": 5, "storageSize": len(body)},
+        }, "cost": 1}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def publisher():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Publisher)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.failures = []
+    server.blobs = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def stored_tree(data):
+    with merkle_store.writer(FixedChunker(CHUNK_SIZE)) as writer:
+        for chunk in chunk_stream(io.BytesIO(data), CHUNK_SIZE):
+            writer.add_leaf(hash_chunk(chunk), len(chunk))
+        root = writer.finalize()
+    return root, merkle_store.open(root.hex())
+
+
+def upload(data, tree, publisher, **kwargs):
+    kwargs.setdefault("backoff", 0.01)
+    return upload_multipart(io.BytesIO(data), tree, part_chunks=4, max_workers=2, publisher=publisher.url, **kwargs)
+
+
+def test_parts_reassemble_and_combine_to_root(publisher):
+    data = os.urandom(10 * CHUNK_SIZE + 100)
+    root, tree = stored_tree(data)
+    with tree:
+        segments = upload(data, tree, publisher)
+
+    assert [s["first_chunk"] for s in segments] == [0, 4, 8]
+    assert [s["chunk_count"] for s in segments] == [4, 4, 3]
+    assert b"".join(publisher.blobs[s["blob_id"]] for s in segments) == data
+    assert [s["offset"] for s in segments] == [0, 4 * CHUNK_SIZE, 8 * CHUNK_SIZE]
+    assert combine_subroots(bytes.fromhex(s["subroot"]) for s in segments) == root
+    assert publisher.requests == 3
+
+
+def test_retries_5xx_and_429(publisher):
+    data = os.urandom(6 * CHUNK_SIZE)
+    root, tree = stored_tree(data)
+    publisher.failures = [503, 429, 500]
+    with tree:
+        segments = upload(data, tree, publisher)
+
+    assert b"".join(publisher.blobs[s["blob_id"]] for s in segments) == data
+    assert publisher.requests == 2 + 3
+
+
+def test_gives_up_after_retries(publisher):
+    data = os.urandom(2 * CHUNK_SIZE)
+    _, tree = stored_tree(data)
+    publisher.failures = [502] * 10
+    with tree, pytest.raises(Exception, match="after 3 attempts"):
+        upload(data, tree, publisher, retries=2)
+    assert publisher.requests == 3
+
+
+def test_part_not_matching_tree_is_not_uploaded(publisher):
+    data = os.urandom(4 * CHUNK_SIZE)
+    _, tree = stored_tree(data)
+    tampered = data[:CHUNK_SIZE] + bytes(CHUNK_SIZE) + data[2 * CHUNK_SIZE:]
+    with tree, pytest.raises(Exception, match="does not match"):
+        upload(tampered, tree, publisher)
+    assert publisher.requests == 0
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+from pysui.sui.sui_txn.transaction_builder import ProgrammableTransactionBuilder
+
+from dataset_registry.offchain import register_to_sui
+from dataset_registry.offchain.register_to_sui import DatasetRegistrar, pure_bytes
+
+
+class Result:
+    def __init__(self, ok, digest=None, error=""):
+        self.ok = ok
+        self.result_data = type("TxResponse", (), {"digest": digest})()
+        self.result_string = error
+
+    def is_ok(self):
+        return self.ok
+
+
+class FakeClient:
+    """Records every transaction it is asked to execute."""
+
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.transactions = []
+        self.lock = threading.Lock()
+
+    def execute(self, txn):
+        with self.lock:
+            self.transactions.append(txn)
+            n = len(self.transactions)
+        if not self.ok:
+            return Result(False, error="InsufficientGas")
+        return Result(True, digest=f"digest-{n}")
+
+
+class FakeTransaction:
+    # Stands in for SyncTransaction: the real builder, submitted to the fake client
+    def __init__(self, client):
+        self.client = client
+        self.builder = ProgrammableTransactionBuilder()
+        self.gas_budget = None
+
+    def execute(self, gas_budget):
+        self.gas_budget = int(gas_budget)
+        return self.client.execute(self)
+
+
+@pytest.fixture(autouse=True)
+def fake_transaction(monkeypatch):
+    monkeypatch.setattr(register_to_sui, "SyncTransaction", FakeTransaction)
+
+
+def submit(registrar, n):
+    return [registrar.submit(f"dataset-{i}".encode(), f"blob-{i}", bytes(32), b"proof") for i in range(n)]
+
+
+def test_batch_sent_when_full():
+    client = FakeClient()
+    registrar = DatasetRegistrar(client, max_calls=3, flush_seconds=60, gas_per_call=10, max_gas=1000)
+    futures = submit(registrar, 3)
+
+    assert [f.result(timeout=5) for f in futures] == ["digest-1"] * 3
+    [txn] = client.transactions
+    assert txn.builder.command_frequency["MoveCall"] == 3
+    assert txn.gas_budget == 30
+    # Byte arguments go in as BCS vector<u8> (length prefix first)
+    inputs = [arg.serialize() for arg in txn.builder.inputs]
+    assert pure_bytes(b"blob-0").serialize() in inputs
+    assert registrar.stats() == {"queued": 0, "batches": 1, "registered": 3, "failed": 0}
+    registrar.close()
+
+
+def test_batch_sent_after_flush_seconds():
+    client = FakeClient()
+    registrar = DatasetRegistrar(client, max_calls=100, flush_seconds=0.3)
+    start = time.monotonic()
+    futures = submit(registrar, 2)
+
+    assert [f.result(timeout=5) for f in futures] == ["digest-1"] * 2
+    assert time.monotonic() - start >= 0.3
+    assert len(client.transactions) == 1
+    registrar.close()
+
+
+def test_failed_batch_fails_every_registration():
+    client = FakeClient(ok=False)
+    registrar = DatasetRegistrar(client, max_calls=2, flush_seconds=60)
+    futures = submit(registrar, 2)
+
+    for future in futures:
+        with pytest.raises(Exception, match="InsufficientGas"):
+            future.result(timeout=5)
+    assert registrar.stats()["failed"] == 2
+    registrar.close()
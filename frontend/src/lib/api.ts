@@ -1,4 +1,5 @@
 import { Dataset, Model, ZkProof, suiClient } from "./sui";
+import { BACKEND_URL } from "@/config";
 
 // Mock data for development
 const mockDatasets: Dataset[] = [
@@ -197,6 +198,30 @@ export async function verifyProofOnChain(proofId: string): Promise<boolean> {
   });
 }
 
+// Training history from the backend, newest first. The endpoint returns one
+// page at a time, so follow nextCursor until it runs out; onPage receives the
+// records loaded so far after every page.
+export async function getTrainingHistory(
+  onPage?: (history: any[]) => void,
+  limit = 100
+): Promise<any[]> {
+  const history: any[] = [];
+  let cursor: string | null = null;
+  do {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor) params.set("cursor", cursor);
+    const response = await fetch(`${BACKEND_URL}/api/training-history?${params}`);
+    if (!response.ok) {
+      throw new Error(`Failed to fetch training history: ${response.statusText}`);
+    }
+    const data = await response.json();
+    history.push(...(data.history || []));
+    onPage?.([...history]);
+    cursor = data.nextCursor;
+  } while (cursor);
+  return history;
+}
+
 export function formatBytes(bytes: number): string {
   if (bytes === 0) return "0 Bytes";
   const k = 1024;
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Shield, Database, Activity, Clock, ChevronLeft, ZoomIn, ZoomOut, Maximize2, Archive } from 'lucide-react';
-import {BACKEND_URL} from "@/config"
+import { getTrainingHistory } from "@/lib/api";
 
 export default function LineageGraph() {
   const [trainingHistory, setTrainingHistory] = useState([]);
@@ -18,11 +18,7 @@ export default function LineageGraph() {
   const fetchTrainingHistory = async () => {
     setIsLoading(true);
     try {
-      const response = await fetch(`${BACKEND_URL}/api/training-history`);
-      if (response.ok) {
-        const data = await response.json();
-        setTrainingHistory(data.history || []);
-      }
+      await getTrainingHistory(setTrainingHistory);
     } catch (error) {
       console.error('Failed to fetch training history:', error);
     } finally {
@@ -1,6 +1,7 @@
 import React, { useState } from 'react';
 import { Upload, CheckCircle, XCircle, Shield, FileText, Key, Clock, ChevronLeft, ChevronRight } from 'lucide-react';
 import {BACKEND_URL} from "@/config"
+import { getTrainingHistory } from "@/lib/api";
 
 export default function ModelProvenanceUI() {
   const [activeTab, setActiveTab] = useState('train');
@@ -34,11 +35,7 @@ export default function ModelProvenanceUI() {
   const fetchTrainingHistory = async () => {
     setIsLoadingHistory(true);
     try {
-      const response = await fetch(`${BACKEND_URL}/api/training-history`);
-      if (response.ok) {
-        const data = await response.json();
-        setRecentRequests(data.history || []);
-      }
+      await getTrainingHistory(setRecentRequests);
     } catch (error) {
       console.error('Failed to fetch training history:', error);
     } finally {
@@ -2,8 +2,11 @@ use crate::common::IntentMessage;
 use crate::common::{to_signed_response, IntentScope, ProcessDataRequest, ProcessedDataResponse};
 use crate::AppState;
 use crate::EnclaveError;
+use axum::body::Body;
 use axum::extract::State;
+use axum::http::{header::CONTENT_TYPE, HeaderMap};
 use axum::Json;
+use futures_util::StreamExt;
 use serde::{Deserialize, Serialize};
 use std::sync::Arc;
 use sha2::{Sha256, Digest};
@@ -25,19 +28,38 @@ pub struct ModelWeightRequest {
     pub input_data: String,
 }
 
+/// Content type of a streamed dataset (see DatasetStream), as sent by the backend's enclave_stream.py.
+pub const DATASET_STREAM_CONTENT_TYPE: &str = "application/x-nautilus-dataset";
+
+/// Largest JSON request accepted on the legacy path.
+const MAX_JSON_BODY: usize = 2 * 1024 * 1024;
+
+const STREAM_MAGIC: &[u8; 4] = b"NDS1";
+/// magic | Merkle root | chunk size (u32)
+const STREAM_HEADER_LEN: usize = 4 + 32 + 4;
+/// chunk length (u32) | SHA-256 of the chunk
+const FRAME_HEADER_LEN: usize = 4 + 32;
+/// Upper bound on a single chunk, to reject corrupt length fields early.
+const MAX_CHUNK_LEN: u32 = 64 * 1024 * 1024;
+
 pub async fn process_data(
     State(state): State<Arc<AppState>>,
-    Json(request): Json<ProcessDataRequest<ModelWeightRequest>>,
+    headers: HeaderMap,
+    body: Body,
 ) -> Result<Json<ProcessedDataResponse<IntentMessage<ModelWeightResponse>>>, EnclaveError> {
 
     // Step 1: Generate hash of the request
-    let request_serialized = serde_json::to_string(&request.payload)
-        .map_err(|e| EnclaveError::GenericError(format!("Failed to serialize request: {}", e)))?;
+    let is_stream = headers
+        .get(CONTENT_TYPE)
+        .and_then(|v| v.to_str().ok())
+        .map(|v| v.starts_with(DATASET_STREAM_CONTENT_TYPE))
+        .unwrap_or(false);
 
-    let mut hasher = Sha256::new();
-    hasher.update(request_serialized.as_bytes());
-    let hash_result = hasher.finalize();
-    let request_hash = format!("{:x}", hash_result);
+    let request_hash = if is_stream {
+        hash_dataset_stream(body).await?
+    } else {
+        hash_json_request(body).await?
+    };
 
     // Step 2: Generate enclave-safe integer weights
     // Using the first 16 hex chars of the hash as a seed
@@ -69,3 +91,159 @@ pub async fn process_data(
         IntentScope::ProcessData,
     )))
 }
+
+/// Hash of a JSON ProcessDataRequest<ModelWeightRequest>, as before streaming existed.
+async fn hash_json_request(body: Body) -> Result<String, EnclaveError> {
+    let bytes = axum::body::to_bytes(body, MAX_JSON_BODY)
+        .await
+        .map_err(|e| EnclaveError::GenericError(format!("Failed to read request: {}", e)))?;
+    let request: ProcessDataRequest<ModelWeightRequest> = serde_json::from_slice(&bytes)
+        .map_err(|e| EnclaveError::GenericError(format!("Failed to parse request: {}", e)))?;
+
+    let request_serialized = serde_json::to_string(&request.payload)
+        .map_err(|e| EnclaveError::GenericError(format!("Failed to serialize request: {}", e)))?;
+
+    let mut hasher = Sha256::new();
+    hasher.update(request_serialized.as_bytes());
+    Ok(format!("{:x}", hasher.finalize()))
+}
+
+/// Verify a streamed dataset and return the hash of the whole stream.
+async fn hash_dataset_stream(body: Body) -> Result<String, EnclaveError> {
+    let mut stream = body.into_data_stream();
+    let mut dataset = DatasetStream::new();
+    while let Some(piece) = stream.next().await {
+        let piece = piece
+            .map_err(|e| EnclaveError::GenericError(format!("Failed to read dataset stream: {}", e)))?;
+        dataset.feed(&piece)?;
+    }
+    dataset.finish()
+}
+
+/// Incremental parser and verifier for a streamed dataset:
+///
+///   header:  b"NDS1" | Merkle root (32 bytes) | chunk size (u32)
+///   frame:   chunk length (u32) | SHA-256 of the chunk (32 bytes) | chunk
+///   end:     a frame of length 0 with an all-zero hash
+///
+/// Integers are big-endian. Each chunk is hashed as its bytes arrive and checked against its frame
+/// hash; the leaves are then folded into the Merkle root (odd nodes paired with themselves) and
+/// compared with the header. Only the leaves are kept, never the data.
+struct DatasetStream {
+    header: Vec<u8>,
+    root: Option<[u8; 32]>,
+    frame: Option<Frame>,
+    leaves: Vec<[u8; 32]>,
+    stream_hasher: Sha256,
+    finished: bool,
+}
+
+struct Frame {
+    remaining: u32,
+    expected: [u8; 32],
+    hasher: Sha256,
+}
+
+impl DatasetStream {
+    fn new() -> Self {
+        DatasetStream {
+            header: Vec::with_capacity(STREAM_HEADER_LEN),
+            root: None,
+            frame: None,
+            leaves: Vec::new(),
+            stream_hasher: Sha256::new(),
+            finished: false,
+        }
+    }
+
+    fn feed(&mut self, mut data: &[u8]) -> Result<(), EnclaveError> {
+        self.stream_hasher.update(data);
+        while !data.is_empty() {
+            if self.finished {
+                return Err(EnclaveError::GenericError("Data after the end of the dataset stream".to_string()));
+            }
+
+            if let Some(frame) = self.frame.as_mut() {
+                let n = data.len().min(frame.remaining as usize);
+                frame.hasher.update(&data[..n]);
+                frame.remaining -= n as u32;
+                data = &data[n..];
+                if frame.remaining == 0 {
+                    let frame = self.frame.take().expect("frame is set");
+                    let leaf: [u8; 32] = frame.hasher.finalize().into();
+                    if leaf != frame.expected {
+                        return Err(EnclaveError::GenericError(format!(
+                            "Chunk {} does not match its hash", self.leaves.len()
+                        )));
+                    }
+                    self.leaves.push(leaf);
+                }
+                continue;
+            }
+
+            // Collect a stream or frame header, which may be split across pieces
+            let needed = if self.root.is_none() { STREAM_HEADER_LEN } else { FRAME_HEADER_LEN };
+            let n = data.len().min(needed - self.header.len());
+            self.header.extend_from_slice(&data[..n]);
+            data = &data[n..];
+            if self.header.len() < needed {
+                continue;
+            }
+
+            if self.root.is_none() {
+                if &self.header[..4] != STREAM_MAGIC {
+                    return Err(EnclaveError::GenericError("Not a dataset stream".to_string()));
+                }
+                let mut root = [0u8; 32];
+                root.copy_from_slice(&self.header[4..36]);
+                self.root = Some(root);
+            } else {
+                let length = u32::from_be_bytes(self.header[..4].try_into().expect("4 bytes"));
+                let mut expected = [0u8; 32];
+                expected.copy_from_slice(&self.header[4..36]);
+                if length == 0 {
+                    self.finished = true;
+                } else if length > MAX_CHUNK_LEN {
+                    return Err(EnclaveError::GenericError(format!("Chunk of {} bytes is too large", length)));
+                } else {
+                    self.frame = Some(Frame { remaining: length, expected, hasher: Sha256::new() });
+                }
+            }
+            self.header.clear();
+        }
+        Ok(())
+    }
+
+    fn finish(self) -> Result<String, EnclaveError> {
+        if !self.finished {
+            return Err(EnclaveError::GenericError("Dataset stream ended early".to_string()));
+        }
+        let root = self.root.expect("header was read");
+        if merkle_root(self.leaves) != Some(root) {
+            return Err(EnclaveError::GenericError(format!(
+                "Dataset does not match Merkle root {}",
+                root.iter().map(|b| format!("{:02x}", b)).collect::<String>()
+            )));
+        }
+        Ok(format!("{:x}", self.stream_hasher.finalize()))
+    }
+}
+
+/// Merkle root over SHA-256 leaves, pairing the last node of an odd level with itself.
+fn merkle_root(mut level: Vec<[u8; 32]>) -> Option<[u8; 32]> {
+    if level.is_empty() {
+        return None;
+    }
+    while level.len() > 1 {
+        level = level
+            .chunks(2)
+            .map(|pair| {
+                let mut hasher = Sha256::new();
+                hasher.update(pair[0]);
+                hasher.update(pair.get(1).unwrap_or(&pair[0]));
+                hasher.finalize().into()
+            })
+            .collect();
+    }
+    Some(level[0])
+}
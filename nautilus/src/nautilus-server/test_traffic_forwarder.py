@@ -0,0 +1,127 @@
+"""
+Tests for traffic_forwarder.Forwarder with an AF_UNIX echo server standing in for the enclave.
+
+Run with: python -m pytest nautilus/src/nautilus-server/test_traffic_forwarder.py
+"""
+
+import os
+import socket
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from traffic_forwarder import Forwarder
+
+EOF_MARK = b"<eof>"
+
+
+def echo_server(path):
+    # Echoes every connection; once the client half-closes, sends EOF_MARK and closes
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(64)
+
+    def serve(conn):
+        with conn:
+            try:
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    conn.sendall(data)
+                conn.sendall(EOF_MARK)
+            except OSError:
+                pass  # the forwarder dropped the connection (client closed without reading)
+
+    def accept():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def forwarder():
+    started = []
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "enclave.sock")
+    enclave = echo_server(path)
+
+    def start(**kwargs):
+        fwd = Forwarder(("127.0.0.1", 0), path, remote_family=socket.AF_UNIX, **kwargs)
+        threading.Thread(target=fwd.serve_forever, daemon=True).start()
+        started.append(fwd)
+        return fwd
+
+    yield start
+    for fwd in started:
+        fwd.stop()
+    enclave.close()
+    os.unlink(path)
+    os.rmdir(directory)
+
+
+def connect(fwd):
+    return socket.create_connection(fwd.address, timeout=5)
+
+
+def recv_all(sock):
+    parts = []
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return b"".join(parts)
+        parts.append(data)
+
+
+def test_ten_clients_echo(forwarder):
+    fwd = forwarder()
+
+    def session(i):
+        payload = os.urandom(256 * 1024 + i)
+        with connect(fwd) as sock:
+            sender = threading.Thread(target=lambda: (sock.sendall(payload), sock.shutdown(socket.SHUT_WR)))
+            sender.start()
+            reply = recv_all(sock)
+            sender.join()
+        return reply == payload + EOF_MARK
+
+    with ThreadPoolExecutor(10) as pool:
+        assert all(pool.map(session, range(10)))
+
+
+def test_half_close_is_passed_on(forwarder):
+    fwd = forwarder()
+    with connect(fwd) as sock:
+        sock.sendall(b"request")
+        sock.shutdown(socket.SHUT_WR)
+        # The enclave only answers the marker after seeing our EOF, and its close ends the reply
+        assert recv_all(sock) == b"request" + EOF_MARK
+
+
+def test_connection_limit_queues_extra_clients(forwarder):
+    fwd = forwarder(max_connections=2)
+    first, second = connect(fwd), connect(fwd)
+    for sock in (first, second):
+        sock.sendall(b"ping")
+        assert sock.recv(4) == b"ping"
+
+    third = connect(fwd)  # accepted by the kernel, waits in the backlog
+    third.sendall(b"queued")
+    third.settimeout(0.3)
+    with pytest.raises(socket.timeout):
+        third.recv(6)
+    assert len(fwd.connections) == 2
+
+    first.close()
+    third.settimeout(5)
+    assert third.recv(6) == b"queued"
+    second.close()
+    third.close()
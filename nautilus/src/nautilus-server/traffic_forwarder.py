@@ -5,65 +5,323 @@
 A bidirectional network traffic forwarder that bridges TCP/IP and VSOCK sockets, enabling communication
 between host machines and enclaves.
 Referenced from https://github.com/aws-samples/aws-nitro-enclaves-workshop/blob/main/resources/code/my-first-enclave/secure-local-channel/traffic_forwarder.py
+
+All connections are multiplexed on one thread with selectors (epoll on Linux). Each direction of a
+connection copies through a preallocated buffer with recv_into, so there are no per-connection threads
+and no per-read allocations. At most max_connections are open at once; further clients wait in the
+listen backlog. Every connection keeps byte and latency counters, printed when it closes and for all
+open connections on SIGUSR1.
+
+Usage: traffic_forwarder.py <local_ip> <local_port> <remote_cid> <remote_port> [max_connections]
 """
 
+import errno
+import selectors
+import signal
 import socket
 import sys
-import threading
 import time
 
+BUFFER_SIZE = 64 * 1024
+MAX_CONNECTIONS = 512
+LISTEN_BACKLOG = 128
+
+
+class Pipe:
+    """
+    One direction of a connection: bytes read from source wait in a fixed buffer until they are
+    written to destination.
+    """
+
+    def __init__(self, source, destination, size=BUFFER_SIZE):
+        self.source = source
+        self.destination = destination
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.eof = False
+        self.closed = False  # destination shut down for writing
+        self.bytes = 0
+
+    def pending(self):
+        return self.end - self.start
+
+    def wants_read(self):
+        return not self.eof and self.end < len(self.buffer)
+
+    def wants_write(self):
+        return self.pending() > 0
+
+    def read(self):
+        n = self.source.recv_into(self.view[self.end:])
+        if n == 0:
+            self.eof = True
+        self.end += n
+        return n
+
+    def write(self):
+        n = self.destination.send(self.view[self.start:self.end])
+        self.start += n
+        self.bytes += n
+        if self.start == self.end:
+            self.start = self.end = 0
+        return n
+
+    def finish(self):
+        # Pass the half-close on once everything read has been written
+        if self.eof and not self.pending() and not self.closed:
+            self.closed = True
+            try:
+                self.destination.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+        return self.closed
+
+
+class Connection:
+    def __init__(self, conn_id, client, remote, peer, buffer_size=BUFFER_SIZE):
+        self.id = conn_id
+        self.client = client
+        self.remote = remote
+        self.peer = peer
+        self.upstream = Pipe(client, remote, buffer_size)
+        self.downstream = Pipe(remote, client, buffer_size)
+        self.connecting = True
+        self.opened = time.monotonic()
+        self.connect_latency = None
+        self.first_request = None
+        self.response_latency = None
+        self.last_activity = self.opened
+
+    def done(self):
+        return self.upstream.closed and self.downstream.closed
+
+    def mask(self, sock):
+        # What to wait for on `sock`: reads into the pipe it feeds, writes out of the one it drains
+        if self.connecting:
+            return selectors.EVENT_WRITE if sock is self.remote else 0
+        inbound, outbound = (self.upstream, self.downstream) if sock is self.client else (self.downstream, self.upstream)
+        events = 0
+        if inbound.wants_read():
+            events |= selectors.EVENT_READ
+        if outbound.wants_write():
+            events |= selectors.EVENT_WRITE
+        return events
+
+    def stats(self):
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+
+        now = time.monotonic()
+        return {
+            "id": self.id,
+            "peer": self.peer,
+            "bytes_up": self.upstream.bytes,
+            "bytes_down": self.downstream.bytes,
+            "connect_ms": ms(self.connect_latency),
+            "first_response_ms": ms(self.response_latency),
+            "age_ms": ms(now - self.opened),
+            "idle_ms": ms(now - self.last_activity),
+        }
 
-def server(local_ip, local_port, remote_cid, remote_port):
-    try:
-        dock_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        dock_socket.bind((local_ip, local_port))
-        dock_socket.listen(5)
 
-        while True:
-            client_socket = dock_socket.accept()[0]
+class Forwarder:
+    """
+    Forwards TCP connections accepted on listen_address to remote_address. remote_family is
+    AF_VSOCK in the enclave; tests can point it at an AF_UNIX or AF_INET stand-in.
+    """
 
-            server_socket = socket.socket(socket.AF_VSOCK, socket.SOCK_STREAM)
-            server_socket.connect((remote_cid, remote_port))
+    def __init__(self, listen_address, remote_address, remote_family=None, max_connections=MAX_CONNECTIONS,
+                 listen_family=socket.AF_INET, buffer_size=BUFFER_SIZE):
+        self.remote_address = remote_address
+        self.remote_family = remote_family if remote_family is not None else socket.AF_VSOCK
+        self.max_connections = max_connections
+        self.buffer_size = buffer_size
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
+        self.next_id = 0
+        self.accepting = False
+        self.running = False
 
-            outgoing_thread = threading.Thread(target=forward,
-                                               args=(client_socket,
-                                                     server_socket))
-            incoming_thread = threading.Thread(target=forward,
-                                               args=(server_socket,
-                                                     client_socket))
+        self.listener = socket.socket(listen_family, socket.SOCK_STREAM)
+        if listen_family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(listen_address)
+        self.listener.listen(LISTEN_BACKLOG)
+        self.listener.setblocking(False)
 
-            outgoing_thread.start()
-            incoming_thread.start()
-    finally:
-        new_thread = threading.Thread(target=server,
-                                      args=(local_ip, local_port, remote_cid,
-                                            remote_port))
-        new_thread.start()
+        # Lets stop() wake the loop from another thread or a signal handler
+        self.wakeup_read, self.wakeup_write = socket.socketpair()
+        self.wakeup_read.setblocking(False)
+        self.wakeup_write.setblocking(False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ, None)
+        self._accept(True)
 
-    return
+    @property
+    def address(self):
+        return self.listener.getsockname()
 
+    def _accept(self, enabled):
+        # Stop polling the listener at the connection limit; clients queue in the backlog meanwhile
+        if enabled and not self.accepting:
+            self.selector.register(self.listener, selectors.EVENT_READ, None)
+        elif not enabled and self.accepting:
+            self.selector.unregister(self.listener)
+        self.accepting = enabled
 
-def forward(source, destination):
-    string = ' '
-    while string:
+    def serve_forever(self):
+        self.running = True
+        while self.running:
+            for key, events in self.selector.select():
+                if key.fileobj is self.listener:
+                    self._on_accept()
+                elif key.fileobj is self.wakeup_read:
+                    try:
+                        self.wakeup_read.recv(64)
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._on_event(key.data, key.fileobj, events)
+        self._shutdown()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.wakeup_write.send(b"\0")
+        except OSError:
+            pass
+
+    def stats(self):
+        return [conn.stats() for conn in self.connections.values()]
+
+    def _on_accept(self):
+        while len(self.connections) < self.max_connections:
+            try:
+                client, peer = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # Out of file descriptors and the like: keep serving what is open
+                print(f"[ERROR] accept failed: {e}")
+                return
+            self._open(client, peer)
+        self._accept(False)
+
+    def _open(self, client, peer):
+        remote = None
         try:
-            string = source.recv(1024)
-            if string:
-                destination.sendall(string)
+            client.setblocking(False)
+            if client.family == socket.AF_INET:
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            remote = socket.socket(self.remote_family, socket.SOCK_STREAM)
+            remote.setblocking(False)
+            err = remote.connect_ex(self.remote_address)
+            if err not in (0, errno.EINPROGRESS, errno.EAGAIN):
+                raise OSError(err, f"connect to {self.remote_address} failed: {errno.errorcode.get(err, err)}")
+        except OSError as e:
+            # Out of file descriptors, unreachable enclave and the like: drop this client only
+            print(f"[ERROR] could not open connection from {peer}: {e}")
+            client.close()
+            if remote is not None:
+                remote.close()
+            return
+
+        self.next_id += 1
+        conn = Connection(self.next_id, client, remote, peer, self.buffer_size)
+        self.connections[conn.id] = conn
+        self._update(conn)
+
+    def _on_event(self, conn, sock, events):
+        if conn.id not in self.connections:
+            return  # closed by an earlier event in the same batch
+        try:
+            if conn.connecting:
+                err = conn.remote.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    raise OSError(err, f"connect to {self.remote_address} failed: {errno.errorcode.get(err, err)}")
+                conn.connecting = False
+                conn.connect_latency = time.monotonic() - conn.opened
             else:
-                source.shutdown(socket.SHUT_RD)
-                destination.shutdown(socket.SHUT_WR)
+                self._transfer(conn, sock, events)
+        except (BlockingIOError, InterruptedError):
+            pass
         except ConnectionResetError as e:
             print(f"[WARN] Connection reset by peer: {e}")
-            source.close()
-            destination.close()
-            break
-        except Exception as e:
-            # Catch-all for any other unexpected exceptions
+            self._close(conn)
+            return
+        except OSError as e:
             print(f"[ERROR] Unexpected socket exception: {e}")
-            source.close()
-            destination.close()
-            break
+            self._close(conn)
+            return
+
+        if conn.done():
+            self._close(conn)
+        else:
+            self._update(conn)
+
+    def _transfer(self, conn, sock, events):
+        now = time.monotonic()
+        inbound, outbound = (conn.upstream, conn.downstream) if sock is conn.client else (conn.downstream, conn.upstream)
+        if events & selectors.EVENT_READ and inbound.wants_read():
+            if inbound.read() and inbound is conn.upstream and conn.first_request is None:
+                conn.first_request = now
+            # Write straight away rather than waiting a loop for writability
+            if inbound.wants_write():
+                self._write(inbound)
+        if events & selectors.EVENT_WRITE and outbound.wants_write():
+            self._write(outbound)
+        # Latency from the first request byte to the first response byte reaching the client
+        if conn.response_latency is None and conn.first_request is not None and conn.downstream.bytes:
+            conn.response_latency = now - conn.first_request
+        inbound.finish()
+        outbound.finish()
+        conn.last_activity = now
+
+    def _write(self, pipe):
+        try:
+            pipe.write()
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _update(self, conn):
+        # A socket with nothing to wait for is unregistered until an event on its peer changes that
+        for sock in (conn.client, conn.remote):
+            events = conn.mask(sock)
+            try:
+                key = self.selector.get_key(sock)
+            except KeyError:
+                key = None
+            if key is None:
+                if events:
+                    self.selector.register(sock, events, conn)
+            elif not events:
+                self.selector.unregister(sock)
+            elif events != key.events:
+                self.selector.modify(sock, events, conn)
+
+    def _close(self, conn):
+        self.connections.pop(conn.id, None)
+        for sock in (conn.client, conn.remote):
+            try:
+                self.selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            sock.close()
+        s = conn.stats()
+        print(f"[INFO] connection {s['id']} from {s['peer']} closed: {s['bytes_up']} bytes up, "
+              f"{s['bytes_down']} bytes down, connect {s['connect_ms']} ms, "
+              f"first response {s['first_response_ms']} ms, open {s['age_ms']} ms")
+        if self.running and len(self.connections) < self.max_connections:
+            self._accept(True)
+
+    def _shutdown(self):
+        for conn in list(self.connections.values()):
+            self._close(conn)
+        self._accept(False)
+        for sock in (self.listener, self.wakeup_read, self.wakeup_write):
+            sock.close()
+        self.selector.close()
 
 
 def main(args):
@@ -71,16 +329,19 @@ def main(args):
     local_port = int(args[1])
     remote_cid = int(args[2])
     remote_port = int(args[3])
+    max_connections = int(args[4]) if len(args) > 4 else MAX_CONNECTIONS
+
+    forwarder = Forwarder((local_ip, local_port), (remote_cid, remote_port), max_connections=max_connections)
+
+    def dump_stats(signum, frame):
+        for s in forwarder.stats():
+            print(f"[INFO] {s}")
 
-    thread = threading.Thread(target=server,
-                              args=(local_ip, local_port, remote_cid,
-                                    remote_port))
-    thread.start()
+    signal.signal(signal.SIGUSR1, dump_stats)
     print(
         f"starting forwarder on {local_ip}:{local_port} {remote_cid}:{remote_port}"
     )
-    while True:
-        time.sleep(60)
+    forwarder.serve_forever()
 
 
 if __name__ == '__main__':